@@ -0,0 +1,220 @@
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+from enum import IntFlag
+
+import numpy as np
+import pandas as pd
+import pyvisa
+
+from RingBuffer import RingBuffer
+
+# A bridge reply looks like 'F= 1000.0 HZ C= 12.345678 PF L= 0.0001234 NS V= 15.0 V';
+# each field is a letter, '=', a number and a unit, and F= is only present on some settings.
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_FIELDS = {'frequency': 'F', 'capacitance': 'C', 'loss': 'L', 'voltage': 'V'}
+_FIELD_PATTERNS = {name: re.compile(rf'\b{key}=\s*({_NUMBER})\s*([A-Za-z]*)')
+                   for name, key in _FIELDS.items()}
+_ANY_FIELD = re.compile(rf'\b[A-Z]=\s*{_NUMBER}\s*[A-Za-z]*')
+
+
+class BridgeFlags(IntFlag):
+    OK = 0
+    # no capacitance could be read from the reply
+    INVALID = 1
+    # capacitance was read, but loss or voltage is missing
+    PARTIAL = 2
+    # the reply contains text that is not a field, e.g. an error message
+    EXTRA = 4
+
+
+@dataclass(frozen=True)
+class BridgeReading:
+    """ One parsed bridge reply, see parse_fetch() """
+    capacitance: float
+    capacitance_units: str
+    loss: float
+    loss_units: str
+    voltage: float
+    frequency: float
+    flags: BridgeFlags
+
+
+def parse_fetch(reply):
+    '''
+    Parse one bridge reply into a BridgeReading.  Fields that are missing
+    or unreadable are NaN and flagged, never zero.
+
+    Parameters
+    ----------
+    reply : str
+        The raw reply of the bridge.
+
+    Returns
+    -------
+    BridgeReading
+
+    Example
+    -------
+    >>> parse_fetch('C= 12.345678 PF L= 0.0001234 NS V= 15.0 V').capacitance
+        12.345678
+
+    '''
+    if not isinstance(reply, str):
+        reply = ''
+    values = {}
+    units = {}
+    for name, pattern in _FIELD_PATTERNS.items():
+        match = pattern.search(reply)
+        values[name] = float(match.group(1)) if match else math.nan
+        units[name] = match.group(2) if match else ''
+
+    flags = BridgeFlags.OK
+    if math.isnan(values['capacitance']):
+        flags |= BridgeFlags.INVALID
+    elif math.isnan(values['loss']) or math.isnan(values['voltage']):
+        flags |= BridgeFlags.PARTIAL
+    if _ANY_FIELD.sub('', reply).strip():
+        flags |= BridgeFlags.EXTRA
+
+    return BridgeReading(capacitance=values['capacitance'],
+                         capacitance_units=units['capacitance'],
+                         loss=values['loss'],
+                         loss_units=units['loss'],
+                         voltage=values['voltage'],
+                         frequency=values['frequency'],
+                         flags=flags)
+
+
+def parse_fetch_array(replies):
+    '''
+    Parse many stored bridge replies at once.
+
+    Parameters
+    ----------
+    replies : iterable of str
+        Raw replies of the bridge.
+
+    Returns
+    -------
+    dict
+        NumPy arrays keyed 'capacitance', 'loss', 'voltage', 'frequency'
+        (float64, NaN where missing), 'flags' (int, see BridgeFlags) and
+        'capacitance_units'/'loss_units' (str).
+
+    '''
+    series = pd.Series(list(replies), dtype=object).fillna('').astype(str)
+    result = {}
+    for name, pattern in _FIELD_PATTERNS.items():
+        extracted = series.str.extract(pattern)
+        result[name] = pd.to_numeric(extracted[0], errors='coerce').to_numpy(dtype=np.float64)
+        if name in ('capacitance', 'loss'):
+            result[name + '_units'] = extracted[1].fillna('').to_numpy(dtype=str)
+
+    flags = np.zeros(len(series), dtype=np.int64)
+    invalid = np.isnan(result['capacitance'])
+    flags[invalid] |= BridgeFlags.INVALID
+    flags[~invalid & (np.isnan(result['loss']) | np.isnan(result['voltage']))] |= BridgeFlags.PARTIAL
+    flags[(series.str.replace(_ANY_FIELD, '', regex=True).str.strip() != '').to_numpy()] |= BridgeFlags.EXTRA
+    result['flags'] = flags
+    return result
+
+
+class AHBridge():
+    """
+    Driver for the Andeen-Hagerling capacitance bridge.
+
+    An example for how to use this class may be:
+        >>>> rm = pyvisa.ResourceManager()
+        >>>> andy = AHBridge(rm.open_resource('GPIB0::28::INSTR'))
+        >>>> parse_fetch(andy.fetch()).capacitance
+    """
+
+    def __init__(self, resource, command='SINGLE', average=None):
+        '''
+        Parameters
+        ----------
+        resource : pyvisa resource
+            The opened GPIB resource of the bridge.
+        command : str, optional
+            Query used to take a reading.  'SINGLE' makes the bridge take a
+            new measurement and answers once it is done, so back-to-back
+            queries return every measurement exactly once.  'FETCH'
+            returns the last measurement without waiting. The default is
+            'SINGLE'.
+        average : int, optional
+            Averaging time exponent to configure on the bridge (AVERAGE
+            command).  The default, None, leaves the bridge setting alone.
+        '''
+        self.resource = resource
+        self.command = command
+        if average is not None:
+            self.resource.write(f'AVERAGE {average}')
+
+    def fetch(self):
+        ''' Return the raw reply of the bridge to a reading query. '''
+        return self.resource.query(self.command)
+
+    def read(self):
+        ''' Take a reading and return it parsed, see parse_fetch(). '''
+        return parse_fetch(self.fetch())
+
+
+class BridgeAcquisition(threading.Thread):
+    """
+    Background thread that reads the capacitance bridge back-to-back.
+
+    Every reading is time stamped (at the middle of the query, both on the
+    monotonic clock and the wall clock) and appended to a RingBuffer, so
+    the writer and the GUI can consume every sample the bridge produces
+    instead of one per GUI refresh.  The thread is the only user of the
+    GPIB resource while it runs.
+    """
+
+    COLUMNS = ('t', 'timestamp', 'capacitance', 'loss', 'voltage', 'flags')
+
+    def __init__(self, bridge, capacity=500000, retry=1.0):
+        super().__init__(name='BridgeAcquisition', daemon=True)
+        self.bridge = bridge
+        self.retry = retry
+        self.buffer = RingBuffer(BridgeAcquisition.COLUMNS, capacity)
+        self.errors = 0
+        # the exception of the last failed read, None once a read succeeds again
+        self.last_error = None
+        # the last raw reply, for anything that wants to keep the string
+        self.latest_reply = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            t0 = time.monotonic()
+            try:
+                reply = self.bridge.fetch()
+                t1 = time.monotonic()
+                self.latest_reply = reply
+                reading = parse_fetch(reply)
+            except Exception as e:
+                # whatever went wrong, keep the thread alive so the buffer fills again once the bridge recovers
+                self.errors += 1
+                self.last_error = e
+                print(f"Bridge read failed ({e!r})... retrying in {self.retry}s")
+                self._stop_event.wait(self.retry)
+                continue
+            self.last_error = None
+            # the reading belongs to the middle of the query
+            t = 0.5 * (t0 + t1)
+            wall = time.time() - (t1 - t)
+            self.buffer.append((t, wall, reading.capacitance, reading.loss, reading.voltage, reading.flags))
+
+    def latest(self):
+        ''' Returns the newest capacitance, or NaN if there is none yet. '''
+        row = self.buffer.latest()
+        return math.nan if row is None else row[self.buffer.column('capacitance')]
+
+    def stop(self, timeout=None):
+        ''' Ask the thread to finish and wait for it. '''
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
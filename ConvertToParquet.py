@@ -0,0 +1,223 @@
+"""
+Convert MultiVu .dat files and Ma'ii output .csv files to Parquet.
+
+Every source file becomes one partition of the output dataset
+(OUT/run=<file name>/part-NNNNN.parquet), written in chunks so that
+files larger than memory can be converted.  The MultiVu header (title,
+info lines, startup axes and their scale types) is kept as JSON in the
+'multivu' key of the schema metadata.  A manifest in the output folder
+records the size and modification time of every converted file, so
+files that have not changed since the last run are skipped.
+
+Usage:
+    python ConvertToParquet.py DATA_DIR OUT_DIR [--recursive] [--workers N]
+
+The whole archive can then be read with
+    pyarrow.dataset.dataset(OUT_DIR, partitioning='hive')
+as long as the files share their columns; otherwise read one run=...
+folder at a time.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from MultiVuDataFile import MultiVuDataFile, MultiVuHeader, MultiVuFileException
+
+# readers of the dataset skip names that start with '_'
+MANIFEST = '_manifest.json'
+PATTERNS = ('*.dat', '*.csv')
+
+
+def header_metadata(path, header):
+    '''
+    The parts of a MultiVu header worth keeping with the data, as a dict
+    that can be stored as JSON.
+    '''
+    # STARTUPAXIS counts columns from 1 at Comment; a Ma'ii file has its own columns in front of that
+    first = header.CommentCol if header.CommentCol is not None else 0
+    axes = {}
+    for info in header.Info:
+        if info[0] == 'STARTUPAXIS' and len(info) >= 4:
+            try:
+                column = header.Columns[first + int(info[2]) - 1]
+            except (ValueError, IndexError):
+                column = info[2]
+            axes[info[1]] = {'column': column, 'scale': info[3]}
+    return {'source': os.path.basename(path),
+            'title': header.Title,
+            'columns': header.Columns,
+            'startup_axes': axes,
+            'info': header.Info}
+
+
+def source_key(path):
+    ''' What decides whether a file has changed since it was converted '''
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def partition_name(path):
+    return 'run=' + os.path.splitext(os.path.basename(path))[0]
+
+
+def arrow_schema(chunk):
+    '''
+    The schema every chunk of a file is written with, taken from its
+    first chunk.  Integer columns are stored as float64, since a later
+    chunk of the same column may hold fractions or blanks, and the parts
+    of one partition must agree on their types to be read together.
+    '''
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_integer(field.type):
+            schema = schema.set(i, field.with_type(pa.float64()))
+    return schema
+
+
+def convert_file(path, out_dir, chunksize=500000, compression='zstd'):
+    '''
+    Convert one file to a partition of the output dataset.
+
+    Returns
+    -------
+    dict
+        The manifest entry of the file.
+    '''
+    key = source_key(path)
+    target = os.path.join(out_dir, partition_name(path))
+    tmp = os.path.join(out_dir, '_' + partition_name(path) + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    try:
+        header = MultiVuHeader(path)
+        chunks = MultiVuDataFile().parseMVuDataFile(path, chunksize=chunksize)
+        metadata = header_metadata(path, header)
+    except MultiVuFileException:
+        # a plain csv without a MultiVu header
+        chunks = pd.read_csv(path, chunksize=chunksize)
+        metadata = {'source': os.path.basename(path)}
+
+    rows = 0
+    parts = 0
+    schema = None
+    try:
+        for chunk in chunks:
+            if schema is None:
+                schema = arrow_schema(chunk)
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            table = table.replace_schema_metadata(dict(table.schema.metadata or {},
+                                                       multivu=json.dumps(metadata)))
+            pq.write_table(table, os.path.join(tmp, f'part-{parts:05d}.parquet'), compression=compression)
+            rows += len(chunk)
+            parts += 1
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    return dict(key, rows=rows, parts=parts, partition=partition_name(path))
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def find_sources(data_dir, recursive=False):
+    sources = []
+    for pattern in PATTERNS:
+        if recursive:
+            sources.extend(glob.glob(os.path.join(data_dir, '**', pattern), recursive=True))
+        else:
+            sources.extend(glob.glob(os.path.join(data_dir, pattern)))
+    return sorted(os.path.abspath(p) for p in sources)
+
+
+def convert_all(data_dir, out_dir, recursive=False, workers=None, chunksize=500000, force=False):
+    '''
+    Convert every .dat and .csv file of data_dir that is new or has
+    changed since the last run.
+
+    Returns
+    -------
+    (converted, skipped, failed) : counts of files
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    sources = find_sources(data_dir, recursive)
+
+    # two files with the same name would share a partition
+    names = {}
+    for path in sources:
+        names.setdefault(partition_name(path), []).append(path)
+    clashes = {p for paths in names.values() if len(paths) > 1 for p in paths}
+    for path in sorted(clashes):
+        print(f'skipping {path}: another file has the same name')
+
+    todo = []
+    skipped = 0
+    for path in sources:
+        if path in clashes:
+            continue
+        entry = manifest.get(path)
+        if not force and entry is not None and \
+                {k: entry.get(k) for k in ('size', 'mtime_ns')} == source_key(path):
+            skipped += 1
+        else:
+            todo.append(path)
+
+    converted = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_file, path, out_dir, chunksize): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                manifest[path] = future.result()
+                converted += 1
+                print(f'{path}: {manifest[path]["rows"]} rows')
+            except Exception as e:
+                failed += 1
+                print(f'{path}: failed ({e})')
+            save_manifest(out_dir, manifest)
+    return converted, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert MultiVu .dat and Ma'ii .csv files to Parquet.")
+    parser.add_argument('data_dir', help='folder with the .dat/.csv files')
+    parser.add_argument('out_dir', help='folder of the Parquet dataset')
+    parser.add_argument('-r', '--recursive', action='store_true', help='also look in subfolders')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: one per CPU)')
+    parser.add_argument('--chunksize', type=int, default=500000, help='rows per Parquet part')
+    parser.add_argument('-f', '--force', action='store_true', help='convert files even if they have not changed')
+    args = parser.parse_args(argv)
+
+    converted, skipped, failed = convert_all(args.data_dir, args.out_dir, args.recursive,
+                                             args.workers, args.chunksize, args.force)
+    print(f'{converted} converted, {skipped} unchanged, {failed} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,8 +1,22 @@
 import subprocess, re
 import win32com.client
+import win32api
+import win32con
+import win32process
 import sys
+import os
+import json
+import tempfile
 from enum import Enum, auto
 
+# The detected flavor is remembered here so the slow WMIC process scan
+# only has to run when MultiVu has been (re)started.
+CACHE_FILE = os.path.join(os.environ.get('LOCALAPPDATA', tempfile.gettempdir()),
+                          'MultiVuDetect.json')
+
+# older pywin32 releases do not define this access right
+PROCESS_QUERY_LIMITED_INFORMATION = getattr(win32con, 'PROCESS_QUERY_LIMITED_INFORMATION', 0x1000)
+
 
 class instrumentList(Enum):
     DYNACOOL = auto()
@@ -115,6 +129,14 @@ class Instrument():
             Returns the common name of the QD instrument.
 
         '''
+        # Fast path: reuse the last detection if that MultiVu is still running
+        cached = self._readCache()
+        if cached is not None:
+            self.name = cached
+            if verbose:
+                print(self.name + " MultiVu detected (cached).")
+            return self.name
+
         # Build a list of enum, instrumentType
         instrumentNames = list(instrumentList)
         # Remove the last item (called na)
@@ -128,12 +150,16 @@ class Instrument():
         # Attempt to match the expected MV executable names with the programs
         # in the list and instantiate the instrument and add to MultiVuList
         MultiVuList = []
+        pidList = []
         for line in proc.stdout:
             if (line == b'\r\r\n' or line == b'\r\n'):
                 break
             for instr in instrumentNames:
                 if re.findall(self._getExe(instr.name.capitalize()), line.decode()):
                     MultiVuList.append(instr.name)
+                    # ProcessId is the last column of the WMIC output
+                    pid = re.search(r'(\d+)\s*$', line.decode())
+                    pidList.append(int(pid.group(1)) if pid else None)
 
         # Declare errors if to few or too many are found; for one found,
         # declare which version is identified
@@ -151,8 +177,102 @@ class Instrument():
             self.name = MultiVuList[0]
             if verbose:
                 print(MultiVuList[0] + " MultiVu detected.")
+            self._writeCache(self.name, pidList[0])
             return self.name
 
+    def _processExe(self, pid):
+        '''
+        Returns the full path of the executable running as process pid,
+        or an empty string if there is no such process.
+
+        Parameters
+        ----------
+        pid : int
+            The process ID.
+
+        Returns
+        -------
+        string
+            Path to the .exe of the process.
+
+        '''
+        try:
+            # limited access is enough for the image name and is also
+            # granted for processes running elevated or as another user
+            handle = win32api.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        except win32api.error:
+            return ''
+        try:
+            return win32process.QueryFullProcessImageName(handle, 0)
+        except win32api.error:
+            return ''
+        finally:
+            win32api.CloseHandle(handle)
+
+    def _readCache(self):
+        '''
+        Returns the cached MultiVu flavor if the cached process is still
+        running the same executable, otherwise None.
+
+        Returns
+        -------
+        string or None
+            The common name of the QD instrument.
+
+        '''
+        try:
+            with open(CACHE_FILE, 'r') as f:
+                cache = json.load(f)
+            name, pid, exePath = cache['name'], cache['pid'], cache['exePath']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if pid is None or not exePath:
+            return None
+        # The cache is only valid for the exact process that was detected
+        if self._processExe(pid).lower() != exePath.lower():
+            return None
+        if cache.get('classId') != self._getClassId(name):
+            return None
+        return name
+
+    def _writeCache(self, name, pid):
+        '''
+        Save the detected flavor along with the process ID and executable
+        so that the next detection can skip the process scan.
+
+        Parameters
+        ----------
+        name : string
+            The common name of the QD instrument.
+        pid : int
+            The process ID of the running MultiVu.
+
+        '''
+        exePath = self._processExe(pid) if pid is not None else ''
+        cache = {'name': name,
+                 'classId': self._getClassId(name),
+                 'exeName': self._getExe(name),
+                 'pid': pid,
+                 'exePath': exePath,
+                 }
+        try:
+            with open(CACHE_FILE, 'w') as f:
+                json.dump(cache, f)
+        except OSError:
+            # Not being able to cache only costs time on the next start
+            pass
+
+    @staticmethod
+    def clearCache():
+        '''
+        Forget the cached detection so that the next detection does a
+        full process scan.
+        '''
+        try:
+            os.remove(CACHE_FILE)
+        except OSError:
+            pass
+
     # def OpenMultiVu(self):
     #     '''
     #     Opens MultiVu.
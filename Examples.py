@@ -4,25 +4,26 @@ from QDInst import QDInstrument
 
 
 # Communicating with the QD machine/instrument
+# QDInstrument() detects MultiVu and connects once; every property read below polls a fresh value
+QDI = QDInstrument()
 while True:
-    # To poll a new set of readings from the QD machine, QDInstrument() must be invoked
-    QDI = QDInstrument()
+    # snapshot() reads temperature, field and chamber together and returns them as one record
+    snap = QDI.snapshot()
 
     # From this reading, the temperature, field, and chamber parameters can be extracted
-    #QDI.temp # Current temperature of machine {float}
-    #QDI.temp_status_code # Temp status code {int}
-    #QDI.temp_status # Human-readable temp status description {str}
+    #snap.temp # Current temperature of machine {float}
+    #snap.temp_status_code # Temp status code {int}
+    #snap.temp_status # Human-readable temp status description {str}
     #QDI.temp_unit # Returns a string of "K" to indicate kelvin units {str}
-    #print(f"The temperature is {QDI.temp} {QDI.temp_unit}; status is {QDI.temp_status}")
+    #print(f"The temperature is {snap.temp} {QDI.temp_unit}; status is {snap.temp_status}")
 
 
-    QDI.field # Current applied field of machine {float}
-    print(QDI.field_status_code) # Field status code {int}
-    print(QDI.field_status) # Human-readable field status description {str}
+    snap.field # Current applied field of machine {float}
+    print(snap.field_status_code) # Field status code {int}
+    print(snap.field_status) # Human-readable field status description {str}
     QDI.field_unit # Returns a string of "Oe" to indicate oersted units {str}
-    #print(f"The field is at {QDI.field} {QDI.field_unit}; status is {QDI.field_status}")
-
-    #QDI.chamber_status_code # Chamber status code {int}
-    #QDI.chamber_status # Human-readable chamber status description {str}
-    #print(f"The chamber status is {QDI.chamber_status}")
+    #print(f"The field is at {snap.field} {QDI.field_unit}; status is {snap.field_status}")
 
+    #snap.chamber_status_code # Chamber status code {int}
+    #snap.chamber_status # Human-readable chamber status description {str}
+    #print(f"The chamber status is {snap.chamber_status}")
@@ -0,0 +1,321 @@
+import atexit
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def last_row(path, max_bytes=65536):
+    '''
+    Returns the fields of the last complete row of a csv file, reading
+    only its end, or None if there is no such row.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(size - max_bytes, 0))
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    # anything after the last newline was cut off while being written
+    lines = [line for line in data.split(b'\n')[:-1] if line.strip()]
+    if not lines:
+        return None
+    return next(csv.reader([lines[-1].decode(errors='replace')]))
+
+
+def trim_partial_row(path, block=65536):
+    '''
+    Cuts a csv file back to its last newline, so that appending to it
+    does not continue a row that was cut off while being written.
+    Returns the number of bytes removed.
+    '''
+    try:
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(end - block, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+            return size - end
+    except FileNotFoundError:
+        return 0
+
+
+class CsvSink():
+    """
+    The Ma'ii output file, kept open for the whole run.
+
+    Rows are buffered and written out once flush_rows rows are waiting or
+    flush_interval seconds have passed since the last flush, whichever
+    comes first.  Every fsync_interval seconds (and at each explicit
+    checkpoint) the file is also synced to disk, so a crash of the
+    program loses at most flush_interval seconds of rows and a crash of
+    the PC at most fsync_interval seconds.  The file is closed cleanly
+    when the program exits, even without a call to close().
+
+    An example for how to use this class may be:
+        >>>> sink = CsvSink('run1.dat')
+        >>>> sink.write('[Header]\\n')
+        >>>> sink.writerow([1.0, 2.0, 'True'])
+        >>>> sink.poll()      # call periodically to honour the time policy
+        >>>> sink.close()
+    """
+
+    def __init__(self, path, flush_rows=10, flush_interval=5.0, fsync_interval=60.0):
+        '''
+        Parameters
+        ----------
+        path : str
+            Output file, opened for appending.
+        flush_rows : int, optional
+            Rows to buffer before writing them out. The default is 10.
+        flush_interval : float, optional
+            Longest time (s) a row stays buffered. The default is 5.0.
+        fsync_interval : float, optional
+            Longest time (s) between syncs to disk; None syncs only at
+            checkpoints and close. The default is 60.0.
+        '''
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.rows_written = 0
+        self._pending = []
+        self._file = open(path, 'a', newline='', buffering=1 << 16)
+        self._writer = csv.writer(self._file)
+        self._last_flush = time.monotonic()
+        self._last_sync = self._last_flush
+        atexit.register(self.close)
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def write(self, text):
+        ''' Write raw text (header lines) at its place in the row order. '''
+        self._pending.append(text)
+        self.poll()
+
+    def writerow(self, row):
+        self._pending.append(row)
+        self.poll()
+
+    def writerows(self, rows):
+        self._pending.extend(rows)
+        self.poll()
+
+    def poll(self):
+        ''' Flush or sync if the policy says it is time to. '''
+        now = time.monotonic()
+        if len(self._pending) >= self.flush_rows or (self._pending and now - self._last_flush >= self.flush_interval):
+            self.flush()
+        if self.fsync_interval is not None and now - self._last_sync >= self.fsync_interval:
+            self.checkpoint()
+
+    def flush(self):
+        ''' Write every buffered row to the operating system. '''
+        if self._file is None:
+            return
+        for item in self._pending:
+            if isinstance(item, str):
+                self._file.write(item)
+            else:
+                self._writer.writerow(item)
+                self.rows_written += 1
+        self._pending = []
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def checkpoint(self):
+        ''' Flush and sync the file to disk. '''
+        if self._file is None:
+            return
+        self.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self.checkpoint()
+        finally:
+            self._file.close()
+            self._file = None
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Hdf5Sink():
+    """
+    A columnar copy of the Ma'ii output in an HDF5 file, written next to
+    the CSV.  Every column of the output is its own chunked, compressed
+    float64 dataset in the group 'data', so one column can be read
+    without parsing the rest of the file.  Fields that are not numbers
+    are stored as NaN ('True'/'False' become 1/0); the CSV keeps the
+    text.  Run metadata is stored as attributes of the file.
+
+    Rows are buffered like in CsvSink and appended a block at a time.
+
+    An example for how to use this class may be:
+        >>>> sink = Hdf5Sink('run1.h5', ['Capacitance (pF)', 'Temperature (K)'],
+        >>>>                 metadata={'v_table': [0, 10, 20]})
+        >>>> sink.writerow([12.01, 4.2])
+        >>>> sink.close()
+        >>>> with h5py.File('run1.h5') as f:
+        >>>>     cap = f['data/Capacitance (pF)'][:]
+    """
+
+    def __init__(self, path, columns, metadata=None, chunk_rows=1024, compression='gzip',
+                 flush_rows=10, flush_interval=5.0):
+        '''
+        Parameters
+        ----------
+        path : str
+            Output file; an existing file is appended to if its columns match.
+        columns : list of str
+            Column names, in row order.
+        metadata : dict, optional
+            Stored as file attributes; values that HDF5 cannot hold
+            directly are stored as JSON text.
+        chunk_rows : int, optional
+            Rows per HDF5 chunk. The default is 1024.
+        compression : str, optional
+            HDF5 compression filter. The default is 'gzip'.
+        flush_rows, flush_interval : optional
+            Same buffering policy as CsvSink.
+        '''
+        if h5py is None:
+            raise MaiiOutputException('h5py is required for the HDF5 output')
+        self.path = path
+        self.columns = [c.strip() for c in columns]
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+        self._file = h5py.File(path, 'a')
+        group = self._file.require_group('data')
+        # '/' separates groups in HDF5, so it cannot appear in a dataset name
+        self._names = [c.replace('/', '_') or 'column {}'.format(i) for i, c in enumerate(self.columns)]
+        existing = self._file.attrs.get('columns')
+        if existing is not None and list(existing) != self.columns:
+            self._file.close()
+            raise MaiiOutputException('{} already holds a different column layout'.format(path))
+        self._file.attrs['columns'] = self.columns
+        self._datasets = [group[name] if name in group else
+                          group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=np.float64,
+                                               chunks=(chunk_rows,), compression=compression, shuffle=True)
+                          for name in self._names]
+        self.rows_written = self._datasets[0].shape[0] if self._datasets else 0
+        for key, value in (metadata or {}).items():
+            self.set_attribute(key, value)
+        atexit.register(self.close)
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def set_attribute(self, key, value):
+        try:
+            self._file.attrs[key] = value
+        except (TypeError, ValueError):
+            self._file.attrs[key] = json.dumps(value, default=str)
+
+    @staticmethod
+    def _number(field):
+        if isinstance(field, (bool, np.bool_)):
+            return float(field)
+        try:
+            return float(field)
+        except (TypeError, ValueError):
+            text = str(field).strip()
+            if text in ('True', 'False'):
+                return float(text == 'True')
+            return np.nan
+
+    def writerow(self, row):
+        self._pending.append([Hdf5Sink._number(f) for f in row])
+        self.poll()
+
+    def writerows(self, rows):
+        self._pending.extend([Hdf5Sink._number(f) for f in row] for row in rows)
+        self.poll()
+
+    def poll(self):
+        ''' Flush if the policy says it is time to. '''
+        if len(self._pending) >= self.flush_rows or \
+                (self._pending and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        ''' Append the buffered rows to the datasets. '''
+        if self._file is None:
+            return
+        if self._pending:
+            width = len(self._datasets)
+            block = np.full((len(self._pending), width), np.nan)
+            for i, row in enumerate(self._pending):
+                row = row[:width]
+                block[i, :len(row)] = row
+            start = self.rows_written
+            stop = start + len(block)
+            for j, dataset in enumerate(self._datasets):
+                dataset.resize((stop,))
+                dataset[start:stop] = block[:, j]
+            self.rows_written = stop
+            self._pending = []
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def checkpoint(self):
+        self.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+            self._file = None
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MaiiOutputException(Exception):
+    """Ma'ii Output Exception Error"""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import time
+
+
+# where the monitor keeps its journals between runs
+JOURNAL_DIR = os.environ.get('LOCALAPPDATA', tempfile.gettempdir())
+
+
+def journal_path(program):
+    '''
+    The journal file of a program (e.g. 'main' or 'main_field').  Every
+    program has its own, so one never offers to resume the other's run.
+    '''
+    return os.path.join(JOURNAL_DIR, f'MaiiJournal-{program}.jsonl')
+
+
+class MonitorJournal():
+    """
+    A write-ahead journal of the monitor phase, so that a run can be
+    picked up again after MultiVu or Python has crashed.
+
+    Every entry is one JSON line holding the state that changed, and is
+    synced to disk before record() returns.  load() folds the entries
+    together into the latest complete state; a line cut off by a crash is
+    ignored.  Once the run has ended normally, finish() removes the
+    journal, so an existing journal always means an interrupted run.
+
+    An example for how to use this class may be:
+        >>>> journal = MonitorJournal(journal_path('main'))
+        >>>> journal.record('voltage step', v_table_i=3, monitorState='Ready')
+        >>>> state = MonitorJournal.load(journal_path('main'))
+        >>>> journal.finish()
+    """
+
+    def __init__(self, path, fresh=True):
+        '''
+        Parameters
+        ----------
+        path : str
+            The journal file, see journal_path().
+        fresh : bool, optional
+            Start a new journal (True) or append to the existing one
+            when resuming (False). The default is True.
+        '''
+        self.path = path
+        self._file = open(path, 'w' if fresh else 'a', encoding='utf-8')
+        if not fresh and self._file.tell() > 0:
+            # end a line the crash cut off, so the next entry starts on its own line
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+
+    def record(self, event, **state):
+        '''
+        Append an entry and sync it to disk.
+
+        Parameters
+        ----------
+        event : str
+            What happened, e.g. 'state' or 'voltage step'.
+        **state
+            The values to save; they must be JSON serializable.
+        '''
+        entry = {'event': event, 'time': time.time()}
+        entry.update(state)
+        self._file.write(json.dumps(entry, default=str) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def finish(self):
+        ''' The run ended normally; there is nothing to resume. '''
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def load(path):
+        '''
+        Returns the state saved in the journal (later entries override
+        earlier ones), or None if there is no journal to resume from.
+        '''
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        state = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the line being written when the run died
+                continue
+            state.update(entry)
+        return state or None
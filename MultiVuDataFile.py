@@ -5,16 +5,30 @@ Created on Tue Sep  8 14:23:28 2020
 @author: Quantum Design, Inc.
 """
 
+import numpy as np
 import pandas as pd
 import sys
 import os
 import time
 import re
 import subprocess
-from threading import Lock
+import queue
+from threading import Lock, RLock, Thread, Event, current_thread
 from enum import Enum, auto, IntEnum
 from datetime import datetime
 
+# change notification for iter_rows(); without either it polls the file size
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+try:
+    import win32con
+    import win32event
+    import win32file
+except ImportError:
+    win32file = None
+
 LINE_TERM = '\r\n'
 COMMENT_COL_HEADER = 'Comment'
 TIME_COL_HEADER = 'Time Stamp (sec)'
@@ -92,6 +106,15 @@ class MultiVuDataFile():
         # self.__UTF8Enc
         # Add default columns
         self._ColumnList = []
+        # The column layout is frozen when the header is written (see
+        # __FreezeLayout); until then these are unused
+        self.__Slot = None
+        self.__Values = []
+        self.__PersistentMask = 0
+        self.__FreshMask = 0
+        # guards the values and fresh flags, and the order of rows in the file
+        self.__Lock = RLock()
+        self.__Writer = None
         self.AddColumn(COMMENT_COL_HEADER)
         self.AddColumn(TIME_COL_HEADER, TStartupAxisType.mvStartupAxisX)
 
@@ -334,6 +357,25 @@ class MultiVuDataFile():
         for name in ColumnNames:
             self.AddColumn(name)
 
+    def __FreezeLayout(self):
+        '''
+        Fix the column layout once the header has been written: the
+        columns in file order, a label -> slot map, the current values by
+        slot and bitmasks of the persistent and fresh columns.  From then
+        on SetValue(), GetValue() and WriteData() index by slot instead of
+        searching and sorting the column list.
+        '''
+        columns = sorted(self._ColumnList, key=self.__GetIndex)
+        self.__Slot = {col.Label: i for i, col in enumerate(columns)}
+        self.__Values = [col.Value for col in columns]
+        self.__PersistentMask = 0
+        self.__FreshMask = 0
+        for i, col in enumerate(columns):
+            if col.Persistent:
+                self.__PersistentMask |= 1 << i
+            if col.IsFresh:
+                self.__FreshMask |= 1 << i
+
     def __GetIndex(self, e):
         '''
 
@@ -424,13 +466,16 @@ class MultiVuDataFile():
                             raise MultiVuFileException(errorMessage)
                         else:
                             self.__HaveWrittenHeader = True
+                    self.__FreezeLayout()
                     return
 
             # Make sure we don't add any more columns after this
             self.__HaveWrittenHeader = True
+            self.__FreezeLayout()
             return
         # Make sure we don't add any more columns after this
         self.__HaveWrittenHeader = True
+        self.__FreezeLayout()
 
         # Standard header items
         with open(FileName, "a") as f:
@@ -575,26 +620,32 @@ class MultiVuDataFile():
         >>> SetValue('myColumn', 42)
 
         '''
-        LabelInList = False
-        for item in self._ColumnList:
-            if item.Label == Label:
-                if (Label == COMMENT_COL_HEADER) or (type(Value) == str):
-                    # Sanitize comments by replacing all commas with
-                    # semicolons in order not to break the file
-                    # structure. Multivu does not handle
-                    # commas, even if you put strings in quotes!
-                    Value = Value.replace(',', ';')
-                else:
-                    Value = str(Value)
-
-                item.Value = Value
-                item.IsFresh = True
+        if (Label == COMMENT_COL_HEADER) or (type(Value) == str):
+            # Sanitize comments by replacing all commas with
+            # semicolons in order not to break the file
+            # structure. Multivu does not handle
+            # commas, even if you put strings in quotes!
+            Value = Value.replace(',', ';')
+        else:
+            Value = str(Value)
+
+        if self.__Slot is not None:
+            slot = self.__Slot.get(Label)
+            if slot is not None:
+                with self.__Lock:
+                    self.__Values[slot] = Value
+                    self.__FreshMask |= 1 << slot
                 return
-        if not LabelInList:
-            errorString = f"Error writing value '{Value}' to "
-            errorString += f"column '{Label}'. Column not found."
-            raise MultiVuFileException(errorString)
-            return
+        else:
+            for item in self._ColumnList:
+                if item.Label == Label:
+                    item.Value = Value
+                    item.IsFresh = True
+                    return
+        errorString = f"Error writing value '{Value}' to "
+        errorString += f"column '{Label}'. Column not found."
+        raise MultiVuFileException(errorString)
+        return
 
     def GetValue(self, Label):
         '''
@@ -621,16 +672,19 @@ class MultiVuDataFile():
         >>> 42
 
         '''
-        LabelInList = False
-        for item in self._ColumnList:
-            if item.Label == Label:
-                return item.Value
+        if self.__Slot is not None:
+            slot = self.__Slot.get(Label)
+            if slot is not None:
+                return self.__Values[slot]
+        else:
+            for item in self._ColumnList:
+                if item.Label == Label:
+                    return item.Value
 
-        if not LabelInList:
-            errorString = f"Error getting value from column '{Label}'. "
-            errorString += "Column not found."
-            raise MultiVuFileException(errorString)
-            return
+        errorString = f"Error getting value from column '{Label}'. "
+        errorString += "Column not found."
+        raise MultiVuFileException(errorString)
+        return
 
     def GetFreshStatus(self, Label):
         '''
@@ -658,16 +712,19 @@ class MultiVuDataFile():
         >>> True
 
         '''
-        LabelInList = False
-        for item in self._ColumnList:
-            if item.Label == Label:
-                return item.IsFresh
+        if self.__Slot is not None:
+            slot = self.__Slot.get(Label)
+            if slot is not None:
+                return bool((self.__FreshMask >> slot) & 1)
+        else:
+            for item in self._ColumnList:
+                if item.Label == Label:
+                    return item.IsFresh
 
-        if not LabelInList:
-            errorString = f"Error getting value from column '{Label}'."
-            errorString += ' Column not found.'
-            raise MultiVuFileException(errorString)
-            return
+        errorString = f"Error getting value from column '{Label}'."
+        errorString += ' Column not found.'
+        raise MultiVuFileException(errorString)
+        return
 
     def SetFreshStatus(self, Label, status):
         '''
@@ -698,10 +755,20 @@ class MultiVuDataFile():
 
         '''
         LabelInList = False
-        for item in self._ColumnList:
-            if item.Label == Label:
-                item.IsFresh = status
+        if self.__Slot is not None:
+            slot = self.__Slot.get(Label)
+            if slot is not None:
+                with self.__Lock:
+                    if status:
+                        self.__FreshMask |= 1 << slot
+                    else:
+                        self.__FreshMask &= ~(1 << slot)
                 LabelInList = True
+        else:
+            for item in self._ColumnList:
+                if item.Label == Label:
+                    item.IsFresh = status
+                    LabelInList = True
 
         if not LabelInList:
             errorString = f"Error setting value for column '{Label}'."
@@ -738,28 +805,263 @@ class MultiVuDataFile():
             raise MultiVuFileException(errorString)
             return
 
-        lock = Lock()
-        lock.acquire()
-        if GetTimeNow:
-            self.SetValue(TIME_COL_HEADER, datetime.now().timestamp())
-
-        # Add data for those columns where there is valid data
-        # present and it is (fresh or persistent)
-        currentValues = []
-        for item in sorted(self._ColumnList, key=self.__GetIndex):
-            if item.Value != '' and (item.Persistent or item.IsFresh):
-                currentValues.append(item.Value)
+        with self.__Lock:
+            if GetTimeNow:
+                self.SetValue(TIME_COL_HEADER, datetime.now().timestamp())
+
+            # Add data for those columns where there is valid data
+            # present and it is (fresh or persistent)
+            self.__Emit([self.__RowText(self.__Values, self.__FreshMask)])
+
+            # Mark all data as no longer being fresh
+            self.__FreshMask = 0
+
+    def __Emit(self, Lines):
+        '''
+        Append lines to the file.  While the writer thread runs they go
+        into its open file and are flushed with its batches.  Called with
+        the lock held.  A private method.
+        '''
+        text = '\n'.join(Lines) + '\n'
+        if self.__Writer is not None and not self.__Writer.Closed:
+            self.__Writer.Buffer(text, len(Lines))
+        else:
+            with open(self.FullPath, "a") as f:
+                f.write(text)
+
+    def __RowsText(self, Updates):
+        '''
+        The lines for a run of rows, each given as a list of (slot, text)
+        pairs of the values it sets, carrying the values on from row to
+        row.  Values set before go with the first row.  Called with the
+        lock held.  A private method.
+        '''
+        values = self.__Values
+        fresh = self.__FreshMask
+        lines = []
+        for update in Updates:
+            for slot, text in update:
+                values[slot] = text
+                fresh |= 1 << slot
+            lines.append(self.__RowText(values, fresh))
+            fresh = 0
+        self.__FreshMask = 0
+        return lines
+
+    def __CellText(self, Label, Value):
+        '''
+        The text SetValue() would store for Value, or None if the value is
+        missing (None, NaN or ''). A private method.
+        '''
+        if Value is None or (not isinstance(Value, str) and pd.isna(Value)):
+            return None
+        if (Label == COMMENT_COL_HEADER) or (type(Value) == str):
+            text = Value.replace(',', ';') if type(Value) == str else str(Value).replace(',', ';')
+        else:
+            text = str(Value)
+        return text if text != '' else None
+
+    def __RowText(self, Values, FreshMask):
+        '''
+        The line for a row with the given values by slot, holding the
+        values that are fresh or persistent.  A private method.
+        '''
+        written = FreshMask | self.__PersistentMask
+        return ','.join([value if (written >> slot) & 1 and value is not None else ''
+                         for slot, value in enumerate(Values)])
+
+    def WriteRows(self, Rows, Columns=None, Times=None):
+        '''
+        Writes many rows with a single write to the MultiVu file.  Each
+        row is handled like SetValue() for every value it has, followed by
+        WriteData(): missing values (NaN, None or '') are not fresh,
+        persistent columns repeat their last value, and commas in text are
+        replaced by semicolons.  Values set with SetValue() before the call
+        go with the first row.
+
+        Parameters
+        ----------
+        Rows : pandas.DataFrame or 2D array
+            The rows; a DataFrame's column names are the column labels.
+        Columns : list, optional
+            The column labels for the columns of an array. Not needed
+            for a DataFrame.
+        Times : array, optional
+            Time stamp of each row.  If not given, the rows' own
+            'Time Stamp (sec)' values are used, or the current time if
+            there are none.
+
+        Raises
+        ------
+        MultiVuFileException
+            CreateFileAndWriteHeader() must be called first, and every
+            column must be in the file.
+
+        Returns
+        -------
+        None.
+
+        Example
+        -------
+        >>> WriteRows(myDataFrame)
+        >>> WriteRows(myArray, ['myColumnA', 'myColumnB'], Times=myTimes)
+
+        '''
+        if not self.__HaveWrittenHeader:
+            errorString = 'Must write the header file before writing data. '
+            errorString += 'Call the CreateFileAndWriteHeader() method first.'
+            raise MultiVuFileException(errorString)
+
+        if isinstance(Rows, pd.DataFrame):
+            Columns = [str(label) for label in Rows.columns]
+            data = [Rows[label].to_numpy() for label in Rows.columns]
+        else:
+            array = np.asarray(Rows)
+            if array.ndim == 1:
+                array = array.reshape(-1, 1)
+            if Columns is None or len(Columns) != array.shape[1]:
+                raise MultiVuFileException('WriteRows() needs one column label per column of the array')
+            data = [array[:, j] for j in range(array.shape[1])]
+        numRows = len(data[0]) if data else (0 if Times is None else len(Times))
+        if numRows == 0:
+            return
+
+        if Times is None and TIME_COL_HEADER not in Columns:
+            Times = np.full(numRows, datetime.now().timestamp())
+        if Times is not None:
+            keep = [j for j, label in enumerate(Columns) if label != TIME_COL_HEADER]
+            Columns = [Columns[j] for j in keep] + [TIME_COL_HEADER]
+            data = [data[j] for j in keep] + [np.asarray(Times, dtype=np.float64)]
+
+        slots = []
+        for label in Columns:
+            if label not in self.__Slot:
+                errorString = f"Error writing rows to column '{label}'. Column not found."
+                raise MultiVuFileException(errorString)
+            slots.append(self.__Slot[label])
+
+        # convert a column at a time; None marks a missing value
+        texts = []
+        for label, column in zip(Columns, data):
+            missing = pd.isna(column)
+            if column.dtype.kind in 'fiub' and label != COMMENT_COL_HEADER:
+                text = column.astype(str).tolist()
             else:
-                currentValues.append('')
+                text = [str(value).replace(',', ';') for value in column]
+            texts.append([None if m or t == '' else t for m, t in zip(missing, text)])
+
+        updates = [[(slot, text[r]) for slot, text in zip(slots, texts) if text[r] is not None]
+                   for r in range(numRows)]
+        with self.__Lock:
+            self.__Emit(self.__RowsText(updates))
+
+    def StartWriter(self, MaxQueue=10000, FlushRows=100, FlushInterval=1.0):
+        '''
+        Start a background thread that owns the open file and writes the
+        rows submitted with SubmitRow() from any thread, in batches.
+        WriteData() and WriteRows() keep working and go through the same
+        open file.
+
+        Parameters
+        ----------
+        MaxQueue : int, optional
+            Rows that can wait to be written before SubmitRow() blocks or
+            drops rows. The default is 10000.
+        FlushRows : int, optional
+            Rows that may wait in the file's buffer before it is flushed.
+            The default is 100.
+        FlushInterval : float, optional
+            Longest time (s) a row waits before it is flushed to the
+            file. The default is 1.0.
+
+        Returns
+        -------
+        MultiVuFileWriter
+            The writer, whose counters can be watched.
+
+        Example
+        -------
+        >>> writer = StartWriter()
+        >>> SubmitRow({'myColumn': 42})
+        >>> StopWriter()
+
+        '''
+        if not self.__HaveWrittenHeader:
+            errorString = 'Must write the header file before writing data. '
+            errorString += 'Call the CreateFileAndWriteHeader() method first.'
+            raise MultiVuFileException(errorString)
+        with self.__Lock:
+            if self.__Writer is not None and not self.__Writer.Closed:
+                return self.__Writer
+            self.__Writer = MultiVuFileWriter(self, self.__Lock, MaxQueue, FlushRows, FlushInterval)
+        self.__Writer.start()
+        return self.__Writer
+
+    def SubmitRow(self, Values, Time=None, Block=True, Timeout=None):
+        '''
+        Queue one row for the writer thread started by StartWriter().
 
-        with open(self.FullPath, "a") as f:
-            f.write(','.join(currentValues))
-            f.write('\n')
+        Parameters
+        ----------
+        Values : dict
+            Column label -> value, with the same meaning as SetValue().
+        Time : float, optional
+            Time stamp of the row. The default is the time of the call.
+        Block : bool, optional
+            Wait for room if the queue is full (True) or drop the row
+            (False). The default is True.
+        Timeout : float, optional
+            Longest wait (s) for room before the row is dropped. The
+            default is None (wait as long as needed).
 
-        # Mark all data as no longer being fresh
-        for item in self._ColumnList:
-            item.IsFresh = False
-        lock.release()
+        Raises
+        ------
+        MultiVuFileException
+            Every column must be in the file.
+
+        Returns
+        -------
+        bool
+            False if the row was dropped.
+
+        '''
+        if self.__Writer is None or not self.__Writer.is_alive():
+            raise MultiVuFileException('Call StartWriter() before SubmitRow()')
+        for label in Values:
+            if label not in self.__Slot:
+                errorString = f"Error submitting a row with column '{label}'. Column not found."
+                raise MultiVuFileException(errorString)
+        if Time is None and TIME_COL_HEADER not in Values:
+            Time = datetime.now().timestamp()
+        return self.__Writer.Submit(Values, Time, Block, Timeout)
+
+    def StopWriter(self, Timeout=None):
+        '''
+        Write every row still queued, close the file and stop the writer
+        thread.
+        '''
+        if self.__Writer is not None:
+            self.__Writer.Stop(Timeout)
+
+    def _WriteSubmitted(self, Rows, Writer):
+        '''
+        Write rows queued with SubmitRow() into the writer's file; used by
+        the writer thread.
+        '''
+        updates = []
+        for values, time_stamp in Rows:
+            update = []
+            for label, value in values.items():
+                slot = self.__Slot.get(label)
+                text = self.__CellText(label, value)
+                if slot is not None and text is not None:
+                    update.append((slot, text))
+            if time_stamp is not None:
+                update.append((self.__Slot[TIME_COL_HEADER], str(time_stamp)))
+            updates.append(update)
+        with self.__Lock:
+            lines = self.__RowsText(updates)
+            Writer.Buffer('\n'.join(lines) + '\n', len(lines))
 
     def WriteDataUsingList(self, dataList, GetTimeNow=True):
         '''
@@ -805,7 +1107,7 @@ class MultiVuDataFile():
             self.SetValue(dataList[i], dataList[i + 1])
         self.WriteData(GetTimeNow)
 
-    def parseMVuDataFile(self, filePath) -> pd.DataFrame:
+    def parseMVuDataFile(self, filePath, fast=True, usecols=None, chunksize=None) -> pd.DataFrame:
         '''
         Returns a pandas DataFrame of all data points in the given file
 
@@ -813,6 +1115,21 @@ class MultiVuDataFile():
         ----------
         filePath : str
             Path to the MultiVu file.
+        fast : bool, optional
+            Hand the data section to pandas' C csv reader with the column
+            types taken from MultiVuHeader.  Blank values in numeric
+            columns become NaN, blank text values become ''.  Unlike the
+            original line by line parser (fast=False), it skips blank
+            lines, strips the quotes of quoted fields and allows commas
+            inside them; test_MultiVuDataFile.py checks both against each
+            other. The default is True.
+        usecols : list, optional
+            Names of the columns to read (fast parser only). The default
+            is all columns.
+        chunksize : int, optional
+            Return an iterator of DataFrames of this many rows instead of
+            one DataFrame, for files larger than memory (fast parser
+            only). The default is None.
 
         Returns
         -------
@@ -822,7 +1139,43 @@ class MultiVuDataFile():
         Example
         -------
         >>> parseMVuDataFile('myMvFile.dat')
+        >>> for chunk in parseMVuDataFile('myMvFile.dat', usecols=['Time Stamp (sec)'], chunksize=100000):
+
+        '''
+        if not fast:
+            return self.__parseMVuDataFileSlow(filePath)
+
+        header = MultiVuHeader(filePath)
+        columns = header.Columns if usecols is None else list(usecols)
+        numeric = [name for name in columns if header.Dtypes[name] == 'float64']
+        options = dict(header=None,
+                       names=header.Columns,
+                       usecols=columns,
+                       skiprows=len(header.HeaderLines),
+                       skip_blank_lines=True,
+                       keep_default_na=False,
+                       na_values={name: [''] for name in numeric},
+                       engine='c')
+        text = {name: str for name in columns if name not in numeric}
+
+        if chunksize is not None:
+            # a column that looks numeric in the first rows is left for pandas to type chunk by chunk,
+            # since a chunk that fails half way through cannot be read again
+            reader = pd.read_csv(filePath, dtype=text, chunksize=chunksize, **options)
+            return (chunk[columns] for chunk in reader)
+
+        try:
+            frame = pd.read_csv(filePath, dtype=dict(text, **{name: 'float64' for name in numeric}), **options)
+        except ValueError:
+            # a column that looked numeric in the first rows holds text further down
+            frame = pd.read_csv(filePath, dtype=text, **options)
+        return frame[columns]
 
+    def __parseMVuDataFileSlow(self, filePath) -> pd.DataFrame:
+        '''
+        The original parser behind parseMVuDataFile(fast=False): every
+        line becomes a dict of its values (a float where the value is a
+        number), and the list of dicts becomes the DataFrame.
         '''
         allLines = []
 
@@ -926,6 +1279,599 @@ class MultiVuDataFile():
             raise MultiVuFileException(errorMessage)
 
 
+class MultiVuFileWriter(Thread):
+    """
+    The background writer of a MultiVuDataFile, see
+    MultiVuDataFile.StartWriter().  It owns the open file and takes rows
+    from a bounded queue.  Rows (also those written with WriteData() and
+    WriteRows() meanwhile) collect in the file's buffer, which is flushed
+    once FlushRows rows are waiting or the oldest has waited
+    FlushInterval seconds.  Producers block while the queue is full (or
+    drop the row if they ask not to wait); the counters show how often
+    that happens.
+
+    Everything that touches the file holds the data file's lock, so the
+    file is never written after it has been closed.
+
+    Counters:
+        Submitted : rows accepted into the queue
+        Written : rows written to the file
+        Dropped : rows that found the queue full and were not written
+        Blocked : submissions that had to wait for room
+        MaxDepth : the longest the queue has been
+    """
+
+    def __init__(self, DataFile, FileLock, MaxQueue=10000, FlushRows=100, FlushInterval=1.0):
+        super().__init__(name='MultiVuFileWriter', daemon=True)
+        self.DataFile = DataFile
+        self.FlushRows = FlushRows
+        self.FlushInterval = FlushInterval
+        self.Submitted = 0
+        self.Written = 0
+        self.Dropped = 0
+        self.Blocked = 0
+        self.MaxDepth = 0
+        self.Closed = False
+        self.File = open(DataFile.FullPath, 'a')
+        self.__FileLock = FileLock
+        # rows in the file's buffer that have not been flushed, and when the first of them was written
+        self.__Unflushed = 0
+        self.__FirstUnflushed = 0.0
+        self.__Queue = queue.Queue(MaxQueue)
+        self.__Stop = Event()
+        # producers on several threads update the counters
+        self.__CountLock = Lock()
+
+    @property
+    def Depth(self):
+        ''' Rows waiting to be written '''
+        return self.__Queue.qsize()
+
+    def Submit(self, Values, Time, Block=True, Timeout=None):
+        item = (dict(Values), Time)
+        try:
+            self.__Queue.put_nowait(item)
+        except queue.Full:
+            if not Block:
+                with self.__CountLock:
+                    self.Dropped += 1
+                return False
+            with self.__CountLock:
+                self.Blocked += 1
+            try:
+                self.__Queue.put(item, timeout=Timeout)
+            except queue.Full:
+                with self.__CountLock:
+                    self.Dropped += 1
+                return False
+        with self.__CountLock:
+            self.Submitted += 1
+            self.MaxDepth = max(self.MaxDepth, self.__Queue.qsize())
+        return True
+
+    def Buffer(self, Text, Rows):
+        '''
+        Write rows into the file's buffer; they are flushed with the next
+        batch.  Called with the file's lock held.
+        '''
+        self.File.write(Text)
+        if not self.__Unflushed:
+            self.__FirstUnflushed = time.monotonic()
+            if current_thread() is not self:
+                self.__Wake()
+        self.__Unflushed += Rows
+
+    def __Wake(self):
+        ''' Make the thread look at the flush deadline without waiting for a row '''
+        try:
+            self.__Queue.put_nowait(None)
+        except queue.Full:
+            # the thread is busy with the queue and checks the deadline after every batch anyway
+            pass
+
+    def __Flush(self, Force=False):
+        ''' Flush the file if enough rows are waiting or the oldest has waited long enough '''
+        with self.__FileLock:
+            if self.Closed or not self.__Unflushed:
+                return
+            if Force or self.__Unflushed >= self.FlushRows or \
+                    time.monotonic() - self.__FirstUnflushed >= self.FlushInterval:
+                self.File.flush()
+                self.__Unflushed = 0
+
+    def __Timeout(self):
+        ''' How long the thread may wait for a row before it has to flush '''
+        with self.__FileLock:
+            if not self.__Unflushed:
+                return self.FlushInterval
+            return max(self.__FirstUnflushed + self.FlushInterval - time.monotonic(), 0.0)
+
+    def __Write(self, Batch):
+        try:
+            self.DataFile._WriteSubmitted(Batch, self)
+            self.Written += len(Batch)
+        except (OSError, ValueError) as e:
+            with self.__CountLock:
+                self.Dropped += len(Batch)
+            print(f'MultiVu file write failed ({e})... {self.Dropped} rows lost so far')
+
+    def __Take(self, Batch):
+        ''' Add queued rows to Batch without waiting, up to FlushRows rows '''
+        while len(Batch) < self.FlushRows:
+            try:
+                item = self.__Queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                Batch.append(item)
+        return Batch
+
+    def run(self):
+        try:
+            while not (self.__Stop.is_set() and self.__Queue.empty()):
+                try:
+                    item = self.__Queue.get(timeout=self.__Timeout())
+                except queue.Empty:
+                    item = None
+                batch = self.__Take([] if item is None else [item])
+                if batch:
+                    self.__Write(batch)
+                self.__Flush()
+        finally:
+            with self.__FileLock:
+                # rows that arrived while the thread was stopping
+                while True:
+                    batch = self.__Take([])
+                    if not batch:
+                        break
+                    self.__Write(batch)
+                try:
+                    self.File.close()
+                finally:
+                    self.Closed = True
+
+    def Stop(self, Timeout=None):
+        ''' Write what is still queued, close the file and wait for the thread. '''
+        self.__Stop.set()
+        self.__Wake()
+        if self.is_alive():
+            self.join(Timeout)
+
+
+class MultiVuHeader():
+    """
+    The header of a MultiVu data file, parsed once.  It holds the title,
+    the info lines, the column names with a name -> index map, the column
+    types (inferred from the first data rows) and the byte offset of the
+    first data row, so that readers of the file do not have to scan or
+    split the header again.
+    An example for how to use this class may be:
+        >>>> header = MultiVuHeader('myMultiVuFile.dat')
+        >>>> header.ColumnIndex['Temperature (K)']
+        >>>> arrays = header.DecodeRows(rows, ['Time Stamp (sec)', 'Temperature (K)'])
+
+    """
+
+    def __init__(self, FilePath, SampleRows=20):
+        '''
+        Parameters
+        ----------
+        FilePath : str
+            Path to the MultiVu file.
+        SampleRows : int, optional
+            Number of data rows used to infer the column types. The
+            default is 20.
+
+        Raises
+        ------
+        MultiVuFileException
+            The file does not have a complete [Data] section yet.
+        '''
+        self.FilePath = FilePath
+        # the header as it is in the file, from [Header] to the column header line
+        self.HeaderLines = []
+        self.DataOffset = None
+        sample = []
+        with open(FilePath, 'rb') as f:
+            inHeaders = True
+            for raw_line in iter(f.readline, b''):
+                if not raw_line.endswith(b'\n'):
+                    break
+                self.HeaderLines.append(raw_line.decode(errors='replace').rstrip('\r\n') + '\n')
+                if inHeaders:
+                    inHeaders = (raw_line.strip() != b'[Data]')
+                else:
+                    self.DataOffset = f.tell()
+                    break
+            if self.DataOffset is None:
+                errorMessage = f"'{FilePath}' does not have a complete [Data] section yet"
+                raise MultiVuFileException(errorMessage)
+            for raw_line in iter(f.readline, b''):
+                if len(sample) >= SampleRows or not raw_line.endswith(b'\n'):
+                    break
+                if raw_line.strip():
+                    sample.append(raw_line.decode(errors='replace').rstrip('\r\n').split(','))
+
+        self.Columns = self.SplitColumns(self.HeaderLines[-1])
+        self.ColumnIndex = {name: i for i, name in enumerate(self.Columns)}
+        # info lines are the header lines between [Header] and [Data], without comments
+        self.Info = [[item.strip() for item in line.split(',')]
+                     for line in self.HeaderLines[:-2]
+                     if line.strip() and not line.startswith(';') and line.strip() != '[Header]']
+        self.Title = next((info[1] for info in self.Info if info[0] == 'TITLE' and len(info) > 1), '')
+
+        self.TimeCol = self.ColumnIndex.get(TIME_COL_HEADER)
+        if self.TimeCol is None:
+            self.TimeCol = next((i for i, name in enumerate(self.Columns) if 'Time' in name), None)
+        self.CommentCol = self.ColumnIndex.get(COMMENT_COL_HEADER)
+
+        # a column is numeric if every value it has in the sample rows is a number
+        self.Dtypes = {}
+        for i, name in enumerate(self.Columns):
+            values = [row[i] for row in sample if i < len(row) and row[i].strip()]
+            numeric = i != self.CommentCol and all(self.__IsNumber(v) for v in values)
+            self.Dtypes[name] = 'float64' if numeric else 'object'
+
+    @staticmethod
+    def SplitColumns(line):
+        '''
+        Splits a column header line into the column names, without the
+        quotes MultiVu may put around them.
+        '''
+        return [name.strip().strip('"') for name in line.rstrip('\r\n').split(',')]
+
+    @staticmethod
+    def __IsNumber(value):
+        try:
+            float(value)
+            return True
+        except ValueError:
+            return False
+
+    def DecodeRows(self, Rows, Columns=None):
+        '''
+        Turns rows split into fields (as returned by
+        MultiVuFileTail.ReadNewRows()) into one typed array per column.
+
+        Parameters
+        ----------
+        Rows : list
+            Rows, each a list of str.
+        Columns : list, optional
+            Names of the columns to return. The default is all columns.
+
+        Returns
+        -------
+        dict
+            Column name -> numpy array.  Numeric columns are float64,
+            with NaN for blank or malformed values; the rest stay str.
+
+        '''
+        if Columns is None:
+            Columns = self.Columns
+        arrays = {}
+        for name in Columns:
+            i = self.ColumnIndex[name]
+            values = [row[i] if i < len(row) else '' for row in Rows]
+            if self.Dtypes[name] == 'float64':
+                arrays[name] = pd.to_numeric(pd.Series(values, dtype=object),
+                                             errors='coerce').to_numpy(dtype='float64')
+            else:
+                arrays[name] = np.array(values, dtype=object)
+        return arrays
+
+
+class MultiVuFileTail():
+    """
+    This class follows a MultiVu data file that is still being written and
+    returns only the rows that were appended since the previous call.
+    It remembers the byte offset it stopped at, so each call reads just
+    the new bytes instead of the whole file.  A partially written last
+    line is held back until it is complete, and if the file shrinks or
+    is replaced by a new file, reading starts over at its data section.
+    An example for how to use this class may be:
+        >>>> tail = MultiVuFileTail('myMultiVuFile.dat', StartAtEnd=True)
+        >>>> newRows = tail.ReadNewRows()
+
+    """
+
+    HEAD_BYTES = 256
+
+    def __init__(self, FilePath, StartAtEnd=False, Header=None):
+        '''
+        Parameters
+        ----------
+        FilePath : str
+            Path to the MultiVu file.
+        StartAtEnd : bool, optional
+            Skip the rows already in the file when it is first opened, so
+            that only rows appended afterwards are returned. The default
+            is False.
+        Header : MultiVuHeader, optional
+            The already parsed header of the file, which saves looking for
+            the data section and is used by ReadNewArrays(). The default
+            is None.
+        '''
+        self.FilePath = FilePath
+        self.StartAtEnd = StartAtEnd
+        self.Header = Header
+        # byte offset of the first byte not read yet (None until the
+        # data section has been found)
+        self.Offset = None
+        # number of complete data rows returned so far
+        self.RowsRead = 0
+        self.__Partial = b''
+        self.__Identity = None
+
+    def __Reset(self):
+        self.Offset = None
+        self.RowsRead = 0
+        self.__Partial = b''
+
+    def __FindDataStart(self, f):
+        '''
+        Returns the byte offset of the first data row, which follows the
+        [Data] line and the column header line, or None if the file has
+        not got that far yet.
+        '''
+        f.seek(0)
+        inHeaders = True
+        for raw_line in iter(f.readline, b''):
+            if not raw_line.endswith(b'\n'):
+                return None
+            if inHeaders:
+                inHeaders = (raw_line.strip() != b'[Data]')
+            else:
+                # this was the column header line
+                return f.tell()
+        return None
+
+    def ReadNewLines(self):
+        '''
+        Returns the complete data lines (without line endings) appended
+        since the last call.  Blank lines are skipped.
+
+        Returns
+        -------
+        list
+            A list of str, oldest first.
+
+        '''
+        try:
+            f = open(self.FilePath, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            stat = os.fstat(f.fileno())
+            # The start of the header (which holds FILEOPENTIME) tells files
+            # apart even if a new file gets the old one's inode.
+            head = f.read(self.HEAD_BYTES)
+            identity = (stat.st_dev, stat.st_ino)
+            if self.__Identity is not None:
+                oldIdentity, oldHead = self.__Identity
+                sameHead = head.startswith(oldHead) or oldHead.startswith(head)
+            else:
+                oldIdentity, sameHead = identity, True
+            if identity != oldIdentity or not sameHead or \
+                    (self.Offset is not None and stat.st_size < self.Offset):
+                # the file was truncated or replaced; start over with the new one
+                self.__Reset()
+                self.StartAtEnd = False
+                if self.__Identity is not None:
+                    # a new file has a header of its own
+                    self.Header = None
+            self.__Identity = (identity, head)
+
+            if self.Offset is None:
+                if self.Header is not None:
+                    self.Offset = self.Header.DataOffset
+                else:
+                    self.Offset = self.__FindDataStart(f)
+                if self.Offset is None:
+                    return []
+                if self.StartAtEnd:
+                    # begin right after the last complete line
+                    f.seek(0, os.SEEK_END)
+                    end = f.tell()
+                    f.seek(self.Offset)
+                    lastNewline = f.read(end - self.Offset).rfind(b'\n')
+                    self.Offset += lastNewline + 1
+                    self.StartAtEnd = False
+            f.seek(self.Offset)
+            data = f.read()
+        self.Offset += len(data)
+
+        lines = (self.__Partial + data).split(b'\n')
+        # whatever follows the last newline is still being written
+        self.__Partial = lines.pop()
+        newLines = [line.rstrip(b'\r').decode() for line in lines if line.strip()]
+        self.RowsRead += len(newLines)
+        return newLines
+
+    def ReadNewRows(self):
+        '''
+        Returns the data rows appended since the last call, each split
+        into a list of its comma-separated fields.
+        '''
+        return [line.split(',') for line in self.ReadNewLines()]
+
+    def ReadNewArrays(self, Columns=None):
+        '''
+        Returns the data rows appended since the last call as one typed
+        array per column, see MultiVuHeader.DecodeRows().  The header is
+        parsed on the first call if it was not given.
+        '''
+        rows = self.ReadNewRows()
+        if self.Header is None:
+            self.Header = MultiVuHeader(self.FilePath)
+        return self.Header.DecodeRows(rows, Columns)
+
+    @property
+    def Position(self):
+        '''
+        Byte offset of the first line not returned yet, or None before the
+        data section has been found.  Together with RowsRead this is what
+        Resume() needs to carry on where this reader stopped.
+        '''
+        if self.Offset is None:
+            return None
+        return self.Offset - len(self.__Partial)
+
+    def Resume(self, Position, RowsRead=0):
+        '''
+        Continue from a position saved from another reader (for example
+        before a crash) instead of from the start or end of the file.
+        If the file has since become shorter than Position, it is read
+        from the start of its data section instead.
+
+        Parameters
+        ----------
+        Position : int
+            A value of Position.
+        RowsRead : int, optional
+            The matching value of RowsRead. The default is 0.
+        '''
+        self.__Reset()
+        self.__Identity = None
+        self.StartAtEnd = False
+        self.Offset = Position
+        self.RowsRead = RowsRead if Position is not None else 0
+
+
+class _FileWatcher():
+    """
+    Tells iter_rows() when a file may have changed.  Changed() compares
+    the file's size, modification time and inode with the last call, and
+    Wait() sleeps until the operating system reports a change in the
+    file's folder (inotify on Linux, change notification on Windows) or
+    the timeout passes, whichever comes first.  Without either it just
+    sleeps.
+    """
+
+    def __init__(self, FilePath):
+        self.FilePath = os.path.abspath(FilePath)
+        self.__Folder, self.__Name = os.path.split(self.FilePath)
+        self.__Last = None
+        self.__Notify = None
+        self.__Handle = None
+        if inotify_simple is not None and sys.platform.startswith('linux'):
+            flags = inotify_simple.flags
+            try:
+                self.__Notify = inotify_simple.INotify()
+                self.__Notify.add_watch(self.__Folder, flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE |
+                                        flags.MOVED_TO | flags.DELETE)
+            except OSError:
+                self.__Notify = None
+        elif win32file is not None:
+            try:
+                self.__Handle = win32file.FindFirstChangeNotification(
+                    self.__Folder, False,
+                    win32con.FILE_NOTIFY_CHANGE_SIZE | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE |
+                    win32con.FILE_NOTIFY_CHANGE_FILE_NAME)
+            except Exception:
+                self.__Handle = None
+
+    def Changed(self):
+        try:
+            stat = os.stat(self.FilePath)
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            key = None
+        changed = key != self.__Last
+        self.__Last = key
+        return changed
+
+    def Wait(self, Timeout):
+        if self.__Notify is not None:
+            # events for other files in the folder just cause an extra Changed() check
+            self.__Notify.read(timeout=int(Timeout * 1000))
+        elif self.__Handle is not None:
+            if win32event.WaitForSingleObject(self.__Handle, int(Timeout * 1000)) == win32event.WAIT_OBJECT_0:
+                win32file.FindNextChangeNotification(self.__Handle)
+        else:
+            time.sleep(Timeout)
+
+    def Close(self):
+        if self.__Notify is not None:
+            self.__Notify.close()
+            self.__Notify = None
+        if self.__Handle is not None:
+            win32file.FindCloseChangeNotification(self.__Handle)
+            self.__Handle = None
+
+
+def iter_rows(path, follow=True, poll=0.5, columns=None, start_at_end=False, idle=False, timeout=None):
+    '''
+    Yields the rows of a MultiVu data file in typed batches, and with
+    follow=True keeps yielding the rows MultiVu appends to it.
+
+    The header is parsed once (MultiVuHeader) and the file is followed by
+    a MultiVuFileTail, so each batch costs only the new bytes.  Between
+    batches the file is only stat'ed, after waiting for a change
+    notification from the operating system or for poll seconds.
+
+    Parameters
+    ----------
+    path : str
+        Path to the MultiVu file. It does not need to exist yet.
+    follow : bool, optional
+        Keep waiting for new rows (True) or stop at the end of the
+        file (False). The default is True.
+    poll : float, optional
+        Longest wait (s) between checks of the file. The default is 0.5.
+    columns : list, optional
+        Names of the columns to return. The default is all columns.
+    start_at_end : bool, optional
+        Skip the rows already in the file. The default is False.
+    idle : bool, optional
+        Yield an empty batch after every wait without new rows, so that
+        a caller's loop can do other work. The default is False.
+    timeout : float, optional
+        Stop following after this many seconds without new rows. The
+        default is None (follow forever).
+
+    Yields
+    ------
+    pandas.DataFrame
+        The new rows, with float64 numeric columns.
+
+    Example
+    -------
+    >>> for batch in iter_rows('myMvFile.dat'):
+    >>>     plot(batch['Time Stamp (sec)'], batch['Temperature (K)'])
+
+    '''
+    watcher = _FileWatcher(path)
+    tail = None
+    lastData = time.monotonic()
+    try:
+        while True:
+            if watcher.Changed():
+                if tail is None:
+                    try:
+                        tail = MultiVuFileTail(path, StartAtEnd=start_at_end, Header=MultiVuHeader(path))
+                    except (MultiVuFileException, FileNotFoundError):
+                        # the header has not been written yet
+                        tail = None
+                if tail is not None:
+                    arrays = tail.ReadNewArrays(columns)
+                    if len(next(iter(arrays.values()), ())):
+                        lastData = time.monotonic()
+                        yield pd.DataFrame(arrays)
+                        continue
+            if not follow:
+                return
+            if timeout is not None and time.monotonic() - lastData >= timeout:
+                return
+            if idle:
+                names = [] if tail is None or tail.Header is None else \
+                    (tail.Header.Columns if columns is None else list(columns))
+                yield pd.DataFrame(columns=names)
+            watcher.Wait(poll)
+    finally:
+        watcher.Close()
+
+
 class MultiVuFileException(Exception):
     """MultiVu File Exception Error"""
 
@@ -0,0 +1,203 @@
+import bisect
+import io
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+
+from MultiVuDataFile import MultiVuHeader, MultiVuFileException, TIME_COL_HEADER
+
+
+class MultiVuDataIndex():
+    """
+    Random access to the rows of a (possibly still growing) MultiVu data
+    file.
+
+    The file is memory mapped, and a sparse index (the byte offset and
+    time stamp of every `every`-th data row) is kept in a sidecar file
+    next to it ('<file>.idx.npz').  When the data file has grown, only the
+    new bytes are scanned to extend the index, so opening a week-long
+    file a second time costs next to nothing, and read_range() and
+    read_rows() only read the blocks of rows they need.  If the sidecar
+    cannot be written, the index works the same but is rebuilt next time.
+
+    An example for how to use this class may be:
+        >>>> index = MultiVuDataIndex('myMultiVuFile.dat')
+        >>>> sweep = index.read_range(t0, t0 + 3600)
+        >>>> first = index.read_rows(0, 100)
+    """
+
+    HEAD_BYTES = 256
+
+    def __init__(self, path, every=1000, index_path=None):
+        '''
+        Parameters
+        ----------
+        path : str
+            The MultiVu data file.
+        every : int, optional
+            Rows between index entries. The default is 1000.
+        index_path : str, optional
+            The sidecar file. The default is path + '.idx.npz'.
+        '''
+        self.path = path
+        self.every = every
+        self.index_path = index_path or path + '.idx.npz'
+        self.header = MultiVuHeader(path)
+        if self.header.TimeCol is None:
+            raise MultiVuFileException(f"'{path}' has no '{TIME_COL_HEADER}' column")
+        self.rows = 0
+        self._offsets = []
+        self._times = []
+        self._end = self.header.DataOffset
+        self._head = b''
+        self._load()
+        self.refresh()
+
+    def _load(self):
+        try:
+            saved = np.load(self.index_path)
+        except (OSError, ValueError):
+            return
+        with saved:
+            every, end, rows, data_offset = (int(v) for v in saved['meta'])
+            if every != self.every or data_offset != self.header.DataOffset:
+                return
+            self._offsets = saved['offsets'].tolist()
+            self._times = saved['times'].tolist()
+            self._end = end
+            self.rows = rows
+            self._head = saved['head'].tobytes()
+
+    def _save(self):
+        tmp = self.index_path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f,
+                         meta=np.array([self.every, self._end, self.rows, self.header.DataOffset], dtype=np.int64),
+                         offsets=np.array(self._offsets, dtype=np.int64),
+                         times=np.array(self._times, dtype=np.float64),
+                         head=np.frombuffer(self._head, dtype=np.uint8))
+            os.replace(tmp, self.index_path)
+        except OSError:
+            # a read-only folder or a full disk only costs the rescan next time
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _reset(self):
+        self.rows = 0
+        self._offsets = []
+        self._times = []
+        self._end = self.header.DataOffset
+
+    def refresh(self):
+        '''
+        Extend the index with the rows appended since the last refresh.
+        If the file was truncated or replaced, the index is rebuilt.
+
+        Returns
+        -------
+        int
+            Number of new rows.
+        '''
+        with open(self.path, 'rb') as f:
+            head = f.read(self.HEAD_BYTES)
+            size = os.fstat(f.fileno()).st_size
+            if size < self._end or not (head.startswith(self._head) or self._head.startswith(head)):
+                self.header = MultiVuHeader(self.path)
+                self._reset()
+            self._head = head
+            if size <= self._end:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = np.frombuffer(mm, dtype=np.uint8, count=size - self._end, offset=self._end)
+                try:
+                    new_rows, scanned = self._scan(mm, data)
+                finally:
+                    # the mapping cannot be closed while an array still points into it
+                    del data
+        if not scanned:
+            return 0
+        self.rows += new_rows
+        self._end += scanned
+        self._save()
+        return new_rows
+
+    def _scan(self, mm, data):
+        '''
+        Index the complete lines in data, the bytes of mm from self._end on.
+        Returns the number of rows found and the number of bytes scanned.
+        '''
+        ends = np.flatnonzero(data == ord('\n'))
+        if not len(ends):
+            return 0, 0
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        # blank lines (only '\r' or nothing before the newline) are not rows
+        length = ends - starts
+        blank = (length == 0) | ((length == 1) & (data[starts] == ord('\r')))
+        starts = starts[~blank]
+        # the rows that start a new block of the index
+        first = (-self.rows) % self.every
+        for start in starts[first::self.every]:
+            offset = self._end + int(start)
+            line = mm[offset:mm.find(b'\n', offset)].decode(errors='replace')
+            fields = line.rstrip('\r').split(',')
+            try:
+                t = float(fields[self.header.TimeCol])
+            except (ValueError, IndexError):
+                t = self._times[-1] if self._times else -np.inf
+            self._offsets.append(offset)
+            self._times.append(t)
+        return len(starts), int(ends[-1]) + 1
+
+    def _read(self, start, stop, skip, count, usecols):
+        ''' Parse the bytes [start, stop) and return count rows after the first skip '''
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            block = mm[start:stop]
+        columns = self.header.Columns if usecols is None else list(usecols)
+        numeric = [name for name in columns if self.header.Dtypes[name] == 'float64']
+        frame = pd.read_csv(io.BytesIO(block), header=None, names=self.header.Columns, usecols=columns,
+                            skip_blank_lines=True, keep_default_na=False,
+                            na_values={name: [''] for name in numeric},
+                            dtype={name: str for name in columns if name not in numeric},
+                            engine='c')
+        # counted after parsing, since pandas' skiprows would count the blank lines that the index leaves out
+        return frame[columns].iloc[skip:skip + count]
+
+    def read_rows(self, i0, i1, usecols=None):
+        '''
+        Returns data rows i0 up to (not including) i1 as a DataFrame.
+
+        Parameters
+        ----------
+        i0, i1 : int
+            Row numbers, counting data rows from 0 and leaving out blank lines.
+        usecols : list, optional
+            Names of the columns to return. The default is all columns.
+        '''
+        i0 = max(i0, 0)
+        i1 = min(i1, self.rows)
+        if i1 <= i0:
+            return pd.DataFrame(columns=self.header.Columns if usecols is None else list(usecols))
+        block = i0 // self.every
+        last = -(-i1 // self.every)
+        stop = self._offsets[last] if last < len(self._offsets) else self._end
+        frame = self._read(self._offsets[block], stop, i0 - block * self.every, i1 - i0, usecols)
+        frame.index = pd.RangeIndex(i0, i0 + len(frame))
+        return frame
+
+    def read_range(self, t0, t1, usecols=None):
+        '''
+        Returns the data rows with t0 <= time stamp <= t1 as a DataFrame.
+        The time stamps are expected to increase through the file.
+        '''
+        time_col = self.header.Columns[self.header.TimeCol]
+        lo = max(bisect.bisect_right(self._times, t0) - 1, 0)
+        hi = bisect.bisect_right(self._times, t1)
+        columns = None if usecols is None else list(dict.fromkeys(list(usecols) + [time_col]))
+        frame = self.read_rows(lo * self.every, hi * self.every, columns)
+        frame = frame[(frame[time_col] >= t0) & (frame[time_col] <= t1)]
+        return frame if usecols is None else frame[list(usecols)]
@@ -1,106 +1,201 @@
 import win32com.client
 import pythoncom
 from DetectMultiVu import Instrument, MultiVuExeException
+from RingBuffer import RingBuffer
+from dataclasses import dataclass
+import threading
 import sys
+import time
+
+
+# MultiVu status codes, keyed by the integer the COM interface returns
+TEMP_STATES = {
+    1: "Stable",
+    2: "Tracking",
+    5: "Near",
+    6: "Chasing",
+    7: "Pot Operation",
+    10: "Standby",
+    13: "Diagnostic",
+    14: "Impedance Control Error",
+    15: "General Failure",
+}
+
+MAG_STATES = {
+    0: "Undefined",
+    1: "Stable",
+    2: "Switch Warming",
+    3: "Switch Cooling",
+    4: "Holding (Driven)",
+    5: "Iterate",
+    6: "Ramping",
+    7: "Ramping",
+    8: "Resetting",
+    9: "Current Error",
+    10: "Switch Error",
+    11: "Quenching",
+    12: "Charging Error",
+    14: "PSU Error",
+    15: "General Failure",
+}
+
+CHAMBER_STATES = {
+    0: "Sealed",
+    1: "Purged and Sealed",
+    2: "Vented and Sealed",
+    3: "Sealed",
+    4: "Performing Purge/Seal",
+    5: "Performing Vent/Seal",
+    6: "Pre-HiVac",
+    7: "HiVac",
+    8: "Pumping Coninuously",
+    9: "Flooding Continuously",
+    14: "HiVac Error",
+    15: "General Failure",
+}
+
+UNKNOWN_STATE = "Unknown"
+
+
+@dataclass(frozen=True)
+class QDSnapshot:
+    """ One consistent reading of the QD instrument, see QDInstrument.snapshot() """
+    temp: float
+    temp_status: str
+    temp_status_code: int
+    field: float
+    field_status: str
+    field_status_code: int
+    chamber_status: str
+    chamber_status_code: int
+    temp_err: int
+    field_err: int
+    chamber_err: int
+    # host wall-clock time (comparable to the MultiVu time stamp) and a monotonic time for intervals
+    timestamp: float
+    monotonic: float
 
 
 class QDInstrument:
     def __init__(self):
-        if sys.platform == 'win32':
-            try:
-                self._mvu = win32com.client.Dispatch(Instrument(verbose=True).classId)
-            except AttributeError:
-                pass
-        else:
+        '''
+        A long-lived session with MultiVu.  Detection of the running
+        MultiVu flavor and the COM dispatch are done once here, and the
+        same COM proxy is then reused for every read and every setpoint.
+        If MultiVu crashes or is restarted, call reconnect() to rebuild
+        the proxy.
+        '''
+        if sys.platform != 'win32':
             raise Exception('This must be running on a Windows machine')
 
+        self._mvu = None
+        self._instrument = None
+        self.connect()
+
         self.temp_unit = "K"
         self.field_unit = "Oe"
 
-        # Instantiate the 'set' class
-        self.set = QDInstrument._set()
+        # Instantiate the 'set' class, which shares this session's proxy
+        self.set = QDInstrument._set(self)
+
+    def connect(self, verbose=True):
+        '''
+        Detect MultiVu (only if it has not been detected yet) and dispatch
+        the COM object.
+        '''
+        if self._instrument is None:
+            self._instrument = Instrument(verbose=verbose)
+        try:
+            self._mvu = win32com.client.Dispatch(self._instrument.classId)
+        except AttributeError:
+            pass
+
+    def reconnect(self):
+        '''
+        Drop the current COM proxy and dispatch a new one.  The flavor
+        detection is redone as well, since MultiVu may have been restarted
+        as a different flavor or not at all.
+        '''
+        self._mvu = None
+        self._instrument = None
+        self.connect(verbose=True)
 
     def _get_temp_status(self):
         temperature = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_R8, 0)
         temp_status_code = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_I4, 0.0)
         temp_err = self._mvu.GetTemperature(temperature, temp_status_code)
-        TempStates = {
-            "1": "Stable",
-            "2": "Tracking",
-            "5": "Near",
-            "6": "Chasing",
-            "7": "Pot Operation",
-            "10": "Standby",
-            "13": "Diagnostic",
-            "14": "Impedance Control Error",
-            "15": "General Failure",
-        }
-        return temperature.value, TempStates[str(temp_status_code.value)], temp_err
-    
+        return temperature.value, temp_status_code.value, temp_err
+
     def _get_field_status(self):
         field = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_R8, 0)
         field_status_code = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_I4, 0.0)
         field_err = self._mvu.GetField(field, field_status_code)
-        MagStates = {
-            "0": "Undefined",
-            "1": "Stable",
-            "2": "Switch Warming",
-            "3": "Switch Cooling",
-            "4": "Holding (Driven)",
-            "5": "Iterate",
-            "6": "Ramping",
-            "7": "Ramping",
-            "8": "Resetting",
-            "9": "Current Error",
-            "10": "Switch Error",
-            "11": "Quenching",
-            "12": "Charging Error",
-            "14": "PSU Error",
-            "15": "General Failure",
-        }
-        return field.value, MagStates[str(field_status_code.value)], field_err
+        return field.value, field_status_code.value, field_err
+
+    def _get_chamber_status(self):
+        chamber_status_code = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_I4, 0)
+        chamber_err = self._mvu.GetChamber(chamber_status_code)
+        return chamber_status_code.value, chamber_err
+
+    def snapshot(self):
+        '''
+        Read temperature, field and chamber in one pass (one GetTemperature,
+        one GetField and one GetChamber call) and return them together as
+        an immutable QDSnapshot, so that a value and its status always come
+        from the same reading.
+
+        Returns
+        -------
+        QDSnapshot
+
+        '''
+        temp, temp_code, temp_err = self._get_temp_status()
+        field, field_code, field_err = self._get_field_status()
+        chamber_code, chamber_err = self._get_chamber_status()
+        return QDSnapshot(temp=temp,
+                          temp_status=TEMP_STATES.get(temp_code, UNKNOWN_STATE),
+                          temp_status_code=temp_code,
+                          field=field,
+                          field_status=MAG_STATES.get(field_code, UNKNOWN_STATE),
+                          field_status_code=field_code,
+                          chamber_status=CHAMBER_STATES.get(chamber_code, UNKNOWN_STATE),
+                          chamber_status_code=chamber_code,
+                          temp_err=temp_err,
+                          field_err=field_err,
+                          chamber_err=chamber_err,
+                          timestamp=time.time(),
+                          monotonic=time.monotonic())
 
     @property
     def field(self):
         return self._get_field_status()[0]
-    
+
     @property
     def field_status(self):
-        return self._get_field_status()[1]
-    
+        return MAG_STATES.get(self._get_field_status()[1], UNKNOWN_STATE)
+
     @property
     def temp(self):
         return self._get_temp_status()[0]
-    
+
     @property
     def temp_status(self):
-        return self._get_temp_status()[1]
+        return TEMP_STATES.get(self._get_temp_status()[1], UNKNOWN_STATE)
 
 
     @property
     def chamber_status(self):
-        chamber_status_code = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_I4, 0)
-        chamber_err = self._mvu.GetChamber(chamber_status_code)
-        ChamberStates = {
-            "0": "Sealed",
-            "1": "Purged and Sealed",
-            "2": "Vented and Sealed",
-            "3": "Sealed",
-            "4": "Performing Purge/Seal",
-            "5": "Performing Vent/Seal",
-            "6": "Pre-HiVac",
-            "7": "HiVac",
-            "8": "Pumping Coninuously",
-            "9": "Flooding Continuously",
-            "14": "HiVac Error",
-            "15": "General Failure",
-        }
-        return ChamberStates[int(chamber_status_code)], chamber_err
+        chamber_status_code, chamber_err = self._get_chamber_status()
+        return CHAMBER_STATES.get(chamber_status_code, UNKNOWN_STATE), chamber_err
 
 
     class _set:
-        def __init__(self):
-            self._mvu = win32com.client.Dispatch(Instrument(verbose=False).classId)
+        def __init__(self, parent):
+            self._parent = parent
+
+        @property
+        def _mvu(self):
+            return self._parent._mvu
 
         def temp(self, temperature, rate, approach):
             err = self._mvu.SetTemperature(temperature, rate, approach)
@@ -115,4 +210,104 @@ class QDInstrument:
 
         def chamber(self, code):
             err = self._mvu.SetChamber(code)
-            return err
\ No newline at end of file
+            return err
+
+
+class QDPoller(threading.Thread):
+    """
+    Background thread that samples the QD instrument at a fixed rate.
+
+    The thread owns its own QDInstrument (COM proxies belong to the
+    apartment that created them, so it initializes COM itself) and pushes
+    every reading into a RingBuffer.  The GUI, the writer and the state
+    machine can then read the latest value, or a trace over a time
+    window, without making a COM call of their own.
+    """
+
+    COLUMNS = ('t', 'timestamp', 'temp', 'temp_status_code', 'field', 'field_status_code')
+
+    def __init__(self, rate=2.0, capacity=172800, retry=10.0):
+        '''
+        Parameters
+        ----------
+        rate : float, optional
+            Sampling rate in Hz. The default is 2.0.
+        capacity : int, optional
+            Number of samples kept in the ring buffer. The default is one
+            day at 2 Hz.
+        retry : float, optional
+            Seconds to wait before reconnecting after a failed reading.
+            The default is 10.0.
+        '''
+        super().__init__(name='QDPoller', daemon=True)
+        self.period = 1.0 / rate
+        self.retry = retry
+        self.buffer = RingBuffer(QDPoller.COLUMNS, capacity)
+        self.errors = 0
+        self._latest = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        pythoncom.CoInitialize()
+        qd = None
+        try:
+            next_t = time.monotonic()
+            while not self._stop_event.is_set():
+                try:
+                    if qd is None:
+                        qd = QDInstrument()
+                    snap = qd.snapshot()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"QDPoller failed to read MultiVu ({e})... retrying in {self.retry}s")
+                    if self._stop_event.wait(self.retry):
+                        break
+                    try:
+                        if qd is not None:
+                            qd.reconnect()
+                    except Exception:
+                        qd = None
+                    next_t = time.monotonic()
+                    continue
+
+                self._latest = snap
+                self.buffer.append((snap.monotonic, snap.timestamp,
+                                    snap.temp, snap.temp_status_code,
+                                    snap.field, snap.field_status_code))
+
+                # keep a fixed cadence, but never try to catch up on missed samples
+                next_t += self.period
+                delay = next_t - time.monotonic()
+                if delay < 0:
+                    next_t = time.monotonic()
+                    delay = 0
+                self._stop_event.wait(delay)
+        finally:
+            # release the COM proxy before leaving the apartment
+            qd = None
+            pythoncom.CoUninitialize()
+
+    def latest(self, max_age=None):
+        '''
+        Returns the most recent QDSnapshot, or None if there is none yet or
+        it is older than max_age seconds.
+        '''
+        snap = self._latest
+        if snap is None:
+            return None
+        if max_age is not None and time.monotonic() - snap.monotonic > max_age:
+            return None
+        return snap
+
+    def window(self, seconds):
+        '''
+        Returns the samples from the last number of seconds as an array
+        with the columns in QDPoller.COLUMNS.
+        '''
+        return self.buffer.window(time.monotonic() - seconds)
+
+    def stop(self, timeout=None):
+        ''' Ask the thread to finish and wait for it. '''
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
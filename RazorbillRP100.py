@@ -0,0 +1,429 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+
+import pyvisa
+
+CHANNELS = (1, 2)
+
+# firmware slew rate setting (V/s) used for ramps when the supply accepts it
+SLEW_COMMAND = 'sour{channel}:volt:slew'
+
+
+@dataclass(frozen=True)
+class ChannelState:
+    """ The state of one RP100 output channel, see RP100.status() """
+    channel: int
+    enabled: bool
+    setpoint: float
+    # measured output voltage and current, NaN if the supply does not report them
+    voltage: float
+    current: float
+
+    @property
+    def status(self):
+        """ The name the monitor uses for the output state """
+        return "Active" if self.enabled else "Latent"
+
+
+@dataclass(frozen=True)
+class RP100Status:
+    """ Both channels of the RP100, read in as few round trips as possible """
+    ch1: ChannelState
+    ch2: ChannelState
+    timestamp: float
+    monotonic: float
+
+    def channel(self, channel):
+        return self.ch1 if channel == 1 else self.ch2
+
+
+class RP100():
+    """
+    Driver for the Razorbill RP100 piezo power supply.
+
+    Queries for both channels are joined into one SCPI message
+    ('outp1?;sour1:volt?;...') so a full status read costs a single
+    serial round trip.  If the firmware does not answer a joined query
+    correctly, the driver falls back to one query per command and
+    remembers that for the rest of the session.
+
+    The driver keeps a shadow copy of each channel's output state and
+    setpoint and skips writes that would not change them.  Every
+    status() read refreshes the shadow; resync() forces that after
+    errors or outside changes.
+
+    An example for how to use this class may be:
+        >>>> rm = pyvisa.ResourceManager()
+        >>>> sparky = RP100(rm.open_resource('ASRL4::INSTR'))
+        >>>> sparky.output(1, True)
+        >>>> sparky.set_voltage(1, 25.0)
+        >>>> sparky.status().ch1.setpoint
+        >>>> sparky.ground()
+    """
+
+    def __init__(self, resource, measure=True):
+        '''
+        Parameters
+        ----------
+        resource : pyvisa resource
+            The opened serial resource of the power supply.
+        measure : bool, optional
+            Also read back the measured output voltage and current
+            (MEAS<n>:VOLT? / MEAS<n>:CURR?). The default is True.
+        '''
+        self.resource = resource
+        self.measure = measure
+        self.batch = True
+        # None until we know whether the firmware has a slew rate setting
+        self.slew = None
+        # last known output state and setpoint of each channel (None if unknown),
+        # used to skip writes that would not change anything
+        self._enabled = dict.fromkeys(CHANNELS)
+        self._setpoint = dict.fromkeys(CHANNELS)
+        # the ramp thread and the caller share the serial port
+        self._lock = threading.RLock()
+        self._ramp_thread = None
+        self._ramp_stop = threading.Event()
+        self._ramp_targets = None
+        # monotonic time by which the last ramp should be done at its rate
+        self._ramp_end = None
+
+    def identify(self):
+        with self._lock:
+            return self.resource.query('*IDN?').strip()
+
+    def _query_many(self, commands):
+        '''
+        Send several queries and return the list of replies, using a
+        single semicolon-joined message whenever the firmware allows it.
+        '''
+        if self.batch:
+            try:
+                replies = self.resource.query(';'.join(commands)).strip().split(';')
+                if len(replies) == len(commands):
+                    return [reply.strip() for reply in replies]
+            except pyvisa.errors.VisaIOError:
+                pass
+            # the supply may still be answering, or sent part of a reply; drop whatever is left
+            self.resource.clear()
+            replies = [self.resource.query(command).strip() for command in commands]
+            # the separate queries worked, so it is the joining the firmware does not accept
+            print("RP100 did not answer a joined query... using one query per command")
+            self.batch = False
+            return replies
+        return [self.resource.query(command).strip() for command in commands]
+
+    def _status_commands(self):
+        commands = []
+        for channel in CHANNELS:
+            commands.append(f'outp{channel}?')
+            commands.append(f'sour{channel}:volt?')
+            if self.measure:
+                commands.append(f'meas{channel}:volt?')
+                commands.append(f'meas{channel}:curr?')
+        return commands
+
+    def status(self):
+        '''
+        Read the output state, setpoint and (if enabled) measured output
+        of both channels.
+
+        Returns
+        -------
+        RP100Status
+
+        '''
+        with self._lock:
+            try:
+                replies = self._query_many(self._status_commands())
+            except pyvisa.errors.VisaIOError:
+                if not self.measure:
+                    raise
+                # older firmware without the measure subsystem
+                print("RP100 does not report measured outputs... reading setpoints only")
+                self.resource.clear()
+                self.measure = False
+                replies = self._query_many(self._status_commands())
+
+        step = 4 if self.measure else 2
+        channels = []
+        for i, channel in enumerate(CHANNELS):
+            reply = replies[i * step:(i + 1) * step]
+            channels.append(ChannelState(channel=channel,
+                                         enabled=int(float(reply[0])) != 0,
+                                         setpoint=float(reply[1]),
+                                         voltage=float(reply[2]) if self.measure else math.nan,
+                                         current=float(reply[3]) if self.measure else math.nan))
+            # whatever the supply reports is the new shadow state
+            self._enabled[channel] = channels[-1].enabled
+            self._setpoint[channel] = channels[-1].setpoint
+        return RP100Status(ch1=channels[0], ch2=channels[1],
+                           timestamp=time.time(), monotonic=time.monotonic())
+
+    def _write(self, command, channel):
+        try:
+            self.resource.write(command)
+        except pyvisa.errors.VisaIOError:
+            # we no longer know what the supply did with it
+            self._enabled[channel] = None
+            self._setpoint[channel] = None
+            raise
+
+    def output(self, channel, enabled, force=False):
+        '''
+        Turn the output of a channel on (True) or off (False).  Nothing is
+        sent if the output is already known to be in that state, unless
+        force is True.
+        '''
+        with self._lock:
+            if not force and self._enabled[channel] == bool(enabled):
+                return
+            self._write(f'outp{channel} {1 if enabled else 0}', channel)
+            self._enabled[channel] = bool(enabled)
+
+    def set_voltage(self, channel, voltage, force=False):
+        '''
+        Write the voltage setpoint of a channel.  Nothing is sent if the
+        setpoint is already known to be voltage, unless force is True.
+        '''
+        command = f'{voltage:f}'
+        with self._lock:
+            if not force and self._setpoint[channel] == float(command):
+                return
+            self._write(f'sour{channel}:volt {command}', channel)
+            self._setpoint[channel] = float(command)
+
+    def resync(self):
+        '''
+        Forget the shadow state and read it back from the supply, e.g.
+        after an error, a reconnect or a change on the front panel.
+
+        Returns
+        -------
+        RP100Status
+
+        '''
+        with self._lock:
+            self._enabled = dict.fromkeys(CHANNELS)
+            self._setpoint = dict.fromkeys(CHANNELS)
+            return self.status()
+
+    def set_voltages(self, voltages, tolerance=0.1, timeout=30.0, poll=0.05):
+        '''
+        Turn on both outputs, write both setpoints and wait until the
+        readback of both channels is within tolerance of its target.
+        Both channels are written before either is polled, so they
+        settle at the same time.
+
+        Parameters
+        ----------
+        voltages : tuple
+            Target voltages for (ch1, ch2).
+        tolerance : float, optional
+            Allowed difference between readback and target in volts.
+            The default is 0.1.
+        timeout : float, optional
+            Seconds to wait for the channels to settle. The default is 30.
+        poll : float, optional
+            Seconds between readbacks. The default is 0.05.
+
+        Raises
+        ------
+        RP100Exception
+            If the channels have not settled within timeout.
+
+        Returns
+        -------
+        float
+            Seconds from the first write until both channels had settled.
+
+        '''
+        start = time.monotonic()
+        for channel, voltage in zip(CHANNELS, voltages):
+            self.output(channel, True)
+            self.set_voltage(channel, voltage)
+        return self.wait_settled(voltages, tolerance, timeout, poll, start)
+
+    def wait_settled(self, voltages, tolerance=0.1, timeout=30.0, poll=0.05, start=None):
+        '''
+        Poll the readback until both channels are within tolerance of
+        voltages, see set_voltages().  Returns the seconds since start
+        (or since the call, if start is not given).
+        '''
+        if start is None:
+            start = time.monotonic()
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.status()
+            readback = [self.readback(state) for state in self._channels(status)]
+            if all(abs(r - v) <= tolerance for r, v in zip(readback, voltages)):
+                return time.monotonic() - start
+            if time.monotonic() > deadline:
+                errMsg = f"RP100 did not settle at {tuple(voltages)} V within {timeout} s,"
+                errMsg += f" last readback {tuple(readback)} V."
+                raise RP100Exception(errMsg)
+            time.sleep(poll)
+
+    @staticmethod
+    def readback(state):
+        '''
+        The best available voltage of a channel: the measured output if
+        the supply reports it, otherwise the setpoint.
+        '''
+        return state.setpoint if math.isnan(state.voltage) else state.voltage
+
+    def set_slew(self, rate):
+        '''
+        Try to set the firmware slew rate of both channels.
+
+        Returns
+        -------
+        bool
+            True if the supply accepted and reports back the rate, in which
+            case it ramps by itself after a single setpoint write.
+
+        '''
+        if self.slew is False:
+            return False
+        try:
+            with self._lock:
+                for channel in CHANNELS:
+                    command = SLEW_COMMAND.format(channel=channel)
+                    self.resource.write(f'{command} {rate:f}')
+                    if not math.isclose(float(self.resource.query(command + '?')), rate, rel_tol=1e-3):
+                        raise ValueError(command)
+        except (pyvisa.errors.VisaIOError, ValueError):
+            print("RP100 has no usable slew rate setting... ramping in software")
+            with self._lock:
+                self.resource.clear()
+            self.slew = False
+            return False
+        self.slew = True
+        return True
+
+    def ramp(self, voltages, rate, step_period=0.1):
+        '''
+        Start ramping both channels to voltages at rate (V/s) and return
+        without waiting; use ramp_complete() or wait_ramp() to follow it.
+
+        The firmware slew rate is used when the supply has one.  Otherwise a
+        background thread moves both channels together, writing one
+        setpoint per channel every step_period seconds so that the ramp
+        follows the requested rate in real time.
+
+        Returns
+        -------
+        float
+            The expected duration of the ramp in seconds.
+
+        Raises
+        ------
+        RP100Exception
+            If rate is not a positive number of V/s.
+
+        '''
+        if not rate > 0:
+            raise RP100Exception(f"RP100 ramp rate must be positive, got {rate} V/s.")
+        self.stop_ramp()
+        starts = [state.setpoint for state in self._channels(self.status())]
+        duration = max(abs(v - v0) for v, v0 in zip(voltages, starts)) / rate
+        self._ramp_targets = tuple(voltages)
+        self._ramp_end = time.monotonic() + duration
+        for channel in CHANNELS:
+            self.output(channel, True)
+
+        if self.set_slew(rate):
+            for channel, voltage in zip(CHANNELS, voltages):
+                self.set_voltage(channel, voltage)
+            return duration
+
+        self._ramp_stop.clear()
+        self._ramp_thread = threading.Thread(target=self._software_ramp,
+                                             args=(starts, tuple(voltages), rate, step_period),
+                                             name='RP100Ramp', daemon=True)
+        self._ramp_thread.start()
+        return duration
+
+    @staticmethod
+    def _channels(status):
+        return [status.channel(channel) for channel in CHANNELS]
+
+    def _software_ramp(self, starts, targets, rate, step_period):
+        t0 = time.monotonic()
+        while True:
+            elapsed = time.monotonic() - t0
+            done = True
+            for channel, v0, v1 in zip(CHANNELS, starts, targets):
+                step = min(rate * elapsed, abs(v1 - v0))
+                # a channel that has already arrived is skipped by the shadow state
+                self.set_voltage(channel, v0 + math.copysign(step, v1 - v0))
+                done = done and step >= abs(v1 - v0)
+            if done or self._ramp_stop.wait(step_period):
+                return
+
+    def stop_ramp(self):
+        ''' Stop a software ramp where it is; the firmware ramp cannot be interrupted. '''
+        self._ramp_stop.set()
+        if self._ramp_thread is not None:
+            self._ramp_thread.join()
+            self._ramp_thread = None
+
+    def ramp_complete(self, tolerance=0.1):
+        '''
+        Non-blocking check that the last ramp has finished and both
+        channels read back within tolerance of their targets.
+
+        Without measured outputs the readback is the setpoint, which a
+        firmware ramp reaches at once, so the ramp is not reported finished
+        before its expected duration has passed.
+        '''
+        if self._ramp_thread is not None and self._ramp_thread.is_alive():
+            return False
+        if self._ramp_targets is None:
+            return True
+        status = self.status()
+        if not self.measure and time.monotonic() < self._ramp_end:
+            return False
+        readback = [self.readback(state) for state in self._channels(status)]
+        return all(abs(r - v) <= tolerance for r, v in zip(readback, self._ramp_targets))
+
+    def wait_ramp(self, tolerance=0.1, timeout=30.0, poll=0.05):
+        '''
+        Block until the last ramp has finished and settled, see
+        wait_settled().  Returns the seconds spent waiting.
+
+        Without measured outputs this also waits out the expected duration
+        of the ramp, see ramp_complete().
+        '''
+        start = time.monotonic()
+        if self._ramp_thread is not None:
+            self._ramp_thread.join(timeout)
+        remaining = max(timeout - (time.monotonic() - start), 0)
+        self.wait_settled(self._ramp_targets, tolerance, remaining, poll, start)
+        if not self.measure:
+            if self._ramp_end > start + timeout:
+                errMsg = f"RP100 ramp to {self._ramp_targets} V needs longer than {timeout} s."
+                raise RP100Exception(errMsg)
+            time.sleep(max(self._ramp_end - time.monotonic(), 0))
+        return time.monotonic() - start
+
+    def ground(self):
+        ''' Set both channels to 0 V and turn their outputs off. '''
+        self.stop_ramp()
+        # always sent, whatever the shadow state says
+        for channel in CHANNELS:
+            self.set_voltage(channel, 0, force=True)
+            self.output(channel, False, force=True)
+
+
+class RP100Exception(Exception):
+    """RP100 Exception Error"""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,101 @@
+import bisect
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A fixed-size, array-backed buffer of timestamped samples.
+
+    One thread (the acquisition thread) appends rows, and any number of
+    threads may read the latest row or a time window at the same time
+    without taking a lock.  Rows are stored in a preallocated float64
+    array, so appending never allocates, and once the buffer is full the
+    oldest rows are overwritten.
+
+    The first column is expected to be a monotonic time stamp, which is
+    what window() searches on by default.
+
+    An example for how to use this class may be:
+        >>>> buf = RingBuffer(('t', 'temp', 'field'), capacity=10000)
+        >>>> buf.append((time.monotonic(), 300.0, 0.0))
+        >>>> buf.latest()
+        >>>> buf.window(time.monotonic() - 60)
+    """
+
+    def __init__(self, columns, capacity=100000):
+        self.columns = tuple(columns)
+        self.capacity = int(capacity)
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._data = np.full((self.capacity, len(self.columns)), np.nan)
+        # total number of rows ever appended; only the writer changes it
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def count(self):
+        """ Total number of rows appended so far (usable as a read cursor). """
+        return self._count
+
+    def column(self, name):
+        """ Return the array column index of a named column. """
+        return self._index[name]
+
+    def append(self, row):
+        """ Append one row; only a single thread should ever call this. """
+        self._data[self._count % self.capacity] = row
+        # publish the row only once it has been completely written
+        self._count += 1
+
+    def _slice(self, start, stop):
+        """ Copy rows [start, stop) (absolute row numbers) out of the ring. """
+        start = max(start, stop - self.capacity, 0)
+        if stop <= start:
+            return np.empty((0, len(self.columns)))
+        rows = self._data[np.arange(start, stop) % self.capacity]
+        # drop anything the writer may have lapped while we were copying
+        # (including the slot it is writing right now)
+        overwritten = self._count - self.capacity + 1
+        if overwritten > start:
+            rows = rows[min(overwritten - start, len(rows)):]
+        return rows
+
+    def latest(self):
+        """ Return a copy of the newest row, or None if nothing was appended yet. """
+        count = self._count
+        if count == 0:
+            return None
+        return self._data[(count - 1) % self.capacity].copy()
+
+    def last(self, n):
+        """ Return up to the n newest rows, oldest first. """
+        count = self._count
+        return self._slice(count - n, count)
+
+    def since(self, cursor):
+        """
+        Return the rows appended since cursor and the new cursor, so that
+        a consumer can pick up exactly the rows it has not seen yet.
+        """
+        count = self._count
+        return self._slice(cursor, count), count
+
+    def window(self, t0, t1=None, column=0):
+        """
+        Return all rows whose time column lies within [t0, t1].  The time
+        column must be non-decreasing, which lets the bounds be found by
+        bisection instead of scanning the whole buffer.
+        """
+        col = self._index[column] if isinstance(column, str) else column
+        count = self._count
+        start = max(count - self.capacity, 0)
+        logical = range(start, count)
+
+        def key(i):
+            return self._data[i % self.capacity, col]
+
+        lo = start + bisect.bisect_left(logical, t0, key=key)
+        hi = count if t1 is None else start + bisect.bisect_right(logical, t1, key=key)
+        return self._slice(lo, hi)
@@ -0,0 +1,173 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+
+MAGIC = b'MAIISLOG'
+VERSION = 1
+# the header (magic, version, header size, then the channel names as JSON) is padded to this size
+HEADER_SIZE = 4096
+# one sample: wall-clock time stamp, channel id, flags, value
+RECORD = np.dtype([('timestamp', '<f8'), ('channel', '<u2'), ('flags', '<u2'), ('pad', '<u4'), ('value', '<f8')])
+
+
+def _header(channels):
+    names = json.dumps({'channels': list(channels), 'record': RECORD.descr}).encode()
+    size = len(MAGIC) + 8 + len(names)
+    if size > HEADER_SIZE:
+        raise SampleLogException('too many channel names for the sample log header')
+    head = MAGIC + np.array([VERSION, HEADER_SIZE], dtype='<u4').tobytes() + names
+    return head + b'\0' * (HEADER_SIZE - len(head))
+
+
+def read_sample_log(path):
+    '''
+    Open a sample log for analysis without reading it into memory.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    channels : list of str
+        Channel names; a record's channel field is an index into this.
+    records : numpy.memmap
+        Structured array with the fields of RECORD.  A record the writer
+        had not finished when the file was opened is left out.
+
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+    if head[:len(MAGIC)] != MAGIC:
+        raise SampleLogException('{} is not a sample log'.format(path))
+    version, header_size = np.frombuffer(head, dtype='<u4', count=2, offset=len(MAGIC))
+    if version != VERSION:
+        raise SampleLogException('unsupported sample log version {}'.format(version))
+    info = json.loads(head[len(MAGIC) + 8:].rstrip(b'\0'))
+    count = (os.path.getsize(path) - header_size) // RECORD.itemsize
+    if count == 0:
+        return info['channels'], np.zeros(0, dtype=RECORD)
+    return info['channels'], np.memmap(path, dtype=RECORD, mode='r', offset=int(header_size), shape=(int(count),))
+
+
+def channel_samples(path, channel):
+    '''
+    Returns (timestamps, values, flags) of one channel of a sample log.
+    '''
+    channels, records = read_sample_log(path)
+    picked = records[records['channel'] == channels.index(channel)]
+    return picked['timestamp'], picked['value'], picked['flags']
+
+
+class SampleLog(threading.Thread):
+    """
+    Append-only log of every raw sample, as fixed-width binary records.
+
+    Producers hand over blocks of samples with log(); a background thread
+    turns them into records and appends them to the file, so the control
+    loop never waits on the disk.  The file is a fixed-size header
+    followed by RECORD entries and can be opened with read_sample_log()
+    (a numpy memmap) while it is still being written.
+
+    An example for how to use this class may be:
+        >>>> samples = SampleLog('run1.samples', ['capacitance', 'ch1'])
+        >>>> samples.start()
+        >>>> samples.log('capacitance', times, values, flags)
+        >>>> samples.stop()
+        >>>> channels, records = read_sample_log('run1.samples')
+    """
+
+    def __init__(self, path, channels, flush_interval=1.0):
+        '''
+        Parameters
+        ----------
+        path : str
+            Log file. An existing log with the same channels is appended to.
+        channels : list of str
+            Names of the channels that will be logged.
+        flush_interval : float, optional
+            Longest time (s) records wait in the file buffer. The default is 1.0.
+        '''
+        super().__init__(name='SampleLog', daemon=True)
+        self.path = path
+        self.channels = list(channels)
+        self.flush_interval = flush_interval
+        self.records_written = 0
+        self.dropped = 0
+        self._ids = {name: i for i, name in enumerate(self.channels)}
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            existing, _ = read_sample_log(path)
+            if existing != self.channels:
+                raise SampleLogException('{} was written with different channels'.format(path))
+            self._file = open(path, 'r+b')
+            # drop a record that was cut off by a crash
+            size = os.path.getsize(path)
+            self._file.truncate(size - (size - HEADER_SIZE) % RECORD.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(_header(self.channels))
+
+    def log(self, channel, timestamps, values, flags=0):
+        '''
+        Queue samples of one channel for writing; returns immediately.
+
+        Parameters
+        ----------
+        channel : str
+        timestamps, values : float or array
+        flags : int or array, optional
+        '''
+        block = np.zeros(np.size(values), dtype=RECORD)
+        block['timestamp'] = timestamps
+        block['channel'] = self._ids[channel]
+        block['flags'] = flags
+        block['value'] = values
+        self._queue.put(block)
+
+    def run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            try:
+                blocks = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    blocks.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = np.concatenate(blocks)
+            try:
+                self._file.write(records.tobytes())
+                self._file.flush()
+                self.records_written += len(records)
+            except OSError as e:
+                self.dropped += len(records)
+                print(f"Sample log write failed ({e})... {self.dropped} samples lost so far")
+        self._file.close()
+
+    def stop(self, timeout=None):
+        ''' Write what is still queued, close the file and wait for the thread. '''
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        elif not self._file.closed:
+            self._file.close()
+
+
+class SampleLogException(Exception):
+    """Sample Log Exception Error"""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
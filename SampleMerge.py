@@ -0,0 +1,195 @@
+import numpy as np
+
+from StreamStats import StreamStats
+
+
+def _columns(values):
+    ''' values as a float array of shape (samples, channels) '''
+    values = np.asarray(values, dtype=np.float64)
+    return values.reshape(-1, 1) if values.ndim < 2 else values
+
+
+def window_bounds(row_times, sample_times, previous_time=-np.inf):
+    '''
+    For each row, the index range [lo, hi) of the samples that fall in
+    (previous row time, row time].  Both time arrays must be sorted; a
+    row with a NaN time stamp gets an empty range.
+
+    Parameters
+    ----------
+    row_times : array
+        Time stamps of the rows.
+    sample_times : array
+        Time stamps of the samples.
+    previous_time : float, optional
+        Time stamp of the row before the first one. The default is -inf.
+
+    Returns
+    -------
+    lo, hi : arrays of int
+
+    '''
+    edges = np.concatenate(([previous_time], np.asarray(row_times, dtype=np.float64)))
+    # a NaN row time takes the edge before it, otherwise it would sort after every sample
+    edges = np.fmax.accumulate(edges)
+    index = np.searchsorted(sample_times, edges, side='right')
+    return index[:-1], index[1:]
+
+
+def window_join(row_times, sample_times, values, previous_time=-np.inf):
+    '''
+    Assign every sample to the first row at or after it and summarise the
+    samples of each row, for all rows at once.  NaN samples are left out.
+
+    Parameters
+    ----------
+    row_times : array, shape (rows,)
+        Time stamps of the rows, sorted.
+    sample_times : array, shape (samples,)
+        Time stamps of the samples, sorted.
+    values : array, shape (samples,) or (samples, channels)
+        The sample values.
+    previous_time : float, optional
+        Time stamp of the row before the first one; older samples are
+        ignored. The default is -inf.
+
+    Returns
+    -------
+    StreamStats
+        With one set of channels per row; stats[i] is the summary of row i.
+
+    '''
+    values = _columns(values)
+    lo, hi = window_bounds(row_times, sample_times, previous_time)
+
+    finite = ~np.isnan(values)
+    # subtract a typical value first so the running sums keep their precision
+    shift = np.nanmean(values, axis=0) if finite.any() else np.zeros(values.shape[1])
+    shift = np.where(np.isnan(shift), 0.0, shift)
+    shifted = np.where(finite, values - shift, 0.0)
+
+    zero = np.zeros((1, values.shape[1]))
+    total = np.concatenate((zero, np.cumsum(shifted, axis=0)))
+    squares = np.concatenate((zero, np.cumsum(shifted ** 2, axis=0)))
+    counts = np.concatenate((zero, np.cumsum(finite, axis=0)))
+
+    count = counts[hi] - counts[lo]
+    s1 = total[hi] - total[lo]
+    s2 = squares[hi] - squares[lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, s1 / count, 0.0)
+    m2 = np.clip(s2 - s1 * mean, 0.0, None)
+
+    # the windows are back to back, so reduceat over the start of every non-empty one covers exactly its samples
+    minimum = np.full(count.shape, np.nan)
+    maximum = np.full(count.shape, np.nan)
+    full = lo < hi
+    if full.any():
+        used = values[:hi[full][-1]]
+        minimum[full] = np.fmin.reduceat(used, lo[full], axis=0)
+        maximum[full] = np.fmax.reduceat(used, lo[full], axis=0)
+    return StreamStats.from_moments(count, mean + shift, m2, minimum, maximum)
+
+
+def asof_join(row_times, sample_times, values, tolerance=None):
+    '''
+    For each row, the last sample at or before the row's time stamp (an
+    as-of join).  Rows without such a sample, whose sample is older than
+    tolerance seconds, or with a NaN time stamp get NaN.
+
+    Parameters
+    ----------
+    row_times : array, shape (rows,)
+    sample_times : array, shape (samples,), sorted
+    values : array, shape (samples,) or (samples, channels)
+    tolerance : float, optional
+
+    Returns
+    -------
+    array, shape (rows, channels)
+
+    '''
+    row_times = np.asarray(row_times, dtype=np.float64)
+    values = _columns(values)
+    index = np.searchsorted(sample_times, row_times, side='right') - 1
+    result = np.full((len(row_times), values.shape[1]), np.nan)
+    found = (index >= 0) & ~np.isnan(row_times)
+    if tolerance is not None:
+        found &= (row_times - np.asarray(sample_times)[np.clip(index, 0, None)]) <= tolerance
+    result[found] = values[index[found]]
+    return result
+
+
+class RowMerger():
+    """
+    Joins timestamped samples held in RingBuffers onto MultiVu rows.
+
+    Each source is a RingBuffer with a wall-clock 'timestamp' column (the
+    same clock as the MultiVu time stamp).  A 'window' source assigns
+    every sample to the first row at or after it, so a burst of rows
+    still gets the samples that belong to each of them.  An 'asof' source
+    gives each row the last sample at or before it, for slowly sampled
+    values that would leave most windows empty.  Every sample is taken
+    out of its buffer once, through a read cursor; samples newer than the
+    last row stay in the buffer until the row they belong to arrives.
+
+    An example for how to use this class may be:
+        >>>> merger = RowMerger({'bridge': (bridgeBuffer, ['capacitance']),
+        >>>>                      'supply': (supplyBuffer, ['ch1', 'ch2'], 'asof')})
+        >>>> stats = merger.merge(rowTimes)
+        >>>> for row in stats['bridge']:
+        >>>>     print(row.mean, row.stderr, row.count)
+        >>>> print(stats['supply'])     # shape (rows, 2)
+    """
+
+    def __init__(self, sources, start_time=None):
+        '''
+        Parameters
+        ----------
+        sources : dict
+            name -> (RingBuffer, list of value column names), or
+            (RingBuffer, list of value column names, 'window' or 'asof');
+            the default is 'window'.
+        start_time : float, optional
+            Wall-clock time before which samples are ignored (the time of
+            the row before the first merged one). The default is -inf.
+        '''
+        self.sources = sources
+        self.previous_time = -np.inf if start_time is None else start_time
+        self._cursors = {name: 0 for name in sources}
+        # the newest sample already taken from each 'asof' source, for rows before its next one
+        self._last = {}
+
+    def merge(self, row_times):
+        '''
+        Returns a dict with, for every source, the joined values of the
+        rows with the given time stamps, which must be newer than the rows
+        merged before: a StreamStats (indexed by row, with a channel for
+        each value column) for a 'window' source, an array of shape
+        (rows, columns) for an 'asof' source.  Rows with a NaN time stamp
+        get no samples.
+        '''
+        row_times = np.asarray(row_times, dtype=np.float64)
+        last_time = np.nanmax(row_times) if not np.isnan(row_times).all() else self.previous_time
+        result = {}
+        for name, source in self.sources.items():
+            buffer, columns = source[:2]
+            how = source[2] if len(source) > 2 else 'window'
+            samples, count = buffer.since(self._cursors[name])
+            times = samples[:, buffer.column('timestamp')]
+            # leave the samples after the last row for the rows they belong to
+            used = np.searchsorted(times, last_time, side='right')
+            self._cursors[name] = int(count - (len(samples) - used))
+            times = times[:used]
+            values = samples[:used, [buffer.column(c) for c in columns]]
+            if how == 'asof':
+                if name in self._last:
+                    times = np.concatenate((self._last[name][0], times))
+                    values = np.concatenate((self._last[name][1], values))
+                result[name] = asof_join(row_times, times, values)
+                if len(times):
+                    self._last[name] = (times[-1:], values[-1:])
+            else:
+                result[name] = window_join(row_times, times, values, self.previous_time)
+        self.previous_time = last_time
+        return result
@@ -1,32 +1,13 @@
 import pyvisa
-import time
+from RazorbillRP100 import RP100
 rm = pyvisa.ResourceManager()
-SPARKY = rm.open_resource('ASRL3::INSTR')
+SPARKY = RP100(rm.open_resource('ASRL3::INSTR'))
 
-print('set ch1 volt to 0')
-time.sleep(0.1)
-SPARKY.write('sour1:volt 0')
-
-print('turn off chn 1')
-time.sleep(0.1)
-SPARKY.write('outp1 0')
-
-print('set ch2 volt to 0')
-time.sleep(0.1)
-SPARKY.write('sour2:volt 0')
-
-print('turn off chn 2')
-time.sleep(0.1)
-SPARKY.write('outp2 0')
+print('set both channels to 0 V and turn them off')
+SPARKY.ground()
 
 print('query both channels check that it did turn off')
-time.sleep(0.1)
-print(SPARKY.query('outp1?'))
-print(SPARKY.query('outp2?'))
-
-print('determine voltages')
-time.sleep(0.1)
-print(SPARKY.query('sour1:volt?'))
-print(SPARKY.query('sour2:volt?'))
-
-
+status = SPARKY.status()
+for ch in (status.ch1, status.ch2):
+    print('ch{n}: output {state}, setpoint {volt} V, measured {meas} V'.format(
+        n=ch.channel, state=ch.status, volt=ch.setpoint, meas=ch.voltage))
@@ -0,0 +1,139 @@
+import numpy as np
+
+
+class StreamStats():
+    """
+    Running mean, variance, minimum and maximum of several channels at
+    once, without keeping the samples (Welford's method; batches are
+    merged with the pairwise update of Chan et al.).  NaN samples are
+    skipped per channel, so a failed reading on one channel does not
+    spoil the others.
+
+    An example for how to use this class may be:
+        >>>> stats = StreamStats(2)
+        >>>> stats.add([1.0, 2.0])
+        >>>> stats.add_batch(samples)
+        >>>> print(stats.mean, stats.stderr, stats.count)
+    """
+
+    def __init__(self, channels=1):
+        self.channels = channels
+        self.reset()
+
+    @classmethod
+    def from_moments(cls, count, mean, m2, minimum, maximum):
+        '''
+        Build the statistics from already reduced values: the sample
+        count, mean, sum of squared deviations from the mean, minimum and
+        maximum of each channel.  The arrays may have a leading axis (one
+        set of channels per row, as returned by SampleMerge.window_join);
+        such an object is indexed by row and is only meant for reading.
+        '''
+        stats = cls.__new__(cls)
+        stats.count = np.asarray(count, dtype=np.int64)
+        stats.channels = stats.count.shape[-1]
+        stats._mean = np.asarray(mean, dtype=np.float64)
+        stats._m2 = np.asarray(m2, dtype=np.float64)
+        stats.min = np.asarray(minimum, dtype=np.float64)
+        stats.max = np.asarray(maximum, dtype=np.float64)
+        return stats
+
+    def __len__(self):
+        if self.count.ndim < 2:
+            raise TypeError('only statistics with one row per window have a length')
+        return len(self.count)
+
+    def __getitem__(self, row):
+        ''' The statistics of one row, see from_moments(). '''
+        if self.count.ndim < 2:
+            raise TypeError('only statistics with one row per window can be indexed')
+        return StreamStats.from_moments(self.count[row], self._mean[row], self._m2[row],
+                                        self.min[row], self.max[row])
+
+    def reset(self):
+        ''' Forget every sample added so far. '''
+        self.count = np.zeros(self.channels, dtype=np.int64)
+        self._mean = np.zeros(self.channels)
+        self._m2 = np.zeros(self.channels)
+        self.min = np.full(self.channels, np.nan)
+        self.max = np.full(self.channels, np.nan)
+
+    def add(self, values):
+        '''
+        Add one sample per channel.
+
+        Parameters
+        ----------
+        values : float or sequence of float, one per channel
+        '''
+        x = np.asarray(values, dtype=np.float64).reshape(self.channels)
+        ok = ~np.isnan(x)
+        if not ok.any():
+            return
+        self.count[ok] += 1
+        delta = x[ok] - self._mean[ok]
+        self._mean[ok] += delta / self.count[ok]
+        self._m2[ok] += delta * (x[ok] - self._mean[ok])
+        self.min[ok] = np.fmin(self.min[ok], x[ok])
+        self.max[ok] = np.fmax(self.max[ok], x[ok])
+
+    def add_batch(self, values):
+        '''
+        Add many samples at once.
+
+        Parameters
+        ----------
+        values : array, shape (samples,) or (samples, channels)
+        '''
+        x = np.asarray(values, dtype=np.float64).reshape(-1, self.channels)
+        if not len(x):
+            return
+        n = np.sum(~np.isnan(x), axis=0)
+        ok = n > 0
+        if not ok.any():
+            return
+        with np.errstate(invalid='ignore'):
+            mean = np.where(ok, np.nanmean(np.where(ok, x, 0.0), axis=0), 0.0)
+            m2 = np.where(ok, np.nansum((x - mean) ** 2, axis=0), 0.0)
+        total = self.count + n
+        delta = mean - self._mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._mean = np.where(ok, self._mean + delta * n / total, self._mean)
+            self._m2 = np.where(ok, self._m2 + m2 + delta ** 2 * self.count * n / total, self._m2)
+        self.count = total
+        self.min = np.where(ok, np.fmin(self.min, np.nanmin(np.where(ok, x, 0.0), axis=0)), self.min)
+        self.max = np.where(ok, np.fmax(self.max, np.nanmax(np.where(ok, x, 0.0), axis=0)), self.max)
+
+    def merge(self, other):
+        ''' Add the samples summarised by another StreamStats. '''
+        n = other.count
+        ok = n > 0
+        total = self.count + n
+        delta = other._mean - self._mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._mean = np.where(ok, self._mean + delta * n / total, self._mean)
+            self._m2 = np.where(ok, self._m2 + other._m2 + delta ** 2 * self.count * n / total, self._m2)
+        self.count = total
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+
+    @property
+    def mean(self):
+        ''' Mean of each channel, NaN where there are no samples. '''
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    @property
+    def variance(self):
+        ''' Sample variance of each channel, NaN with fewer than two samples. '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self._m2 / (self.count - 1), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def stderr(self):
+        ''' Standard error of the mean of each channel. '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.std / np.sqrt(self.count)
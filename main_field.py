@@ -1,10 +1,25 @@
 # import pyvisa from NI instruments
-import csv
 import tkinter.filedialog
 
 import pyvisa
 # import QDInst to gain access to MultiVu
-from QDInst import QDInstrument\
+from QDInst import QDInstrument, QDPoller
+# import the MultiVu file reader
+from MultiVuDataFile import MultiVuFileTail, MultiVuHeader, MultiVuFileException
+# import the Razorbill power supply driver
+from RazorbillRP100 import RP100, RP100Exception
+# import the capacitance bridge driver
+from AHBridge import AHBridge, BridgeAcquisition
+# import the buffers and the time join of the instrument samples onto MultiVu rows
+from RingBuffer import RingBuffer
+from SampleMerge import RowMerger
+# import the buffered output file
+from MaiiOutput import CsvSink, Hdf5Sink, MaiiOutputException, last_row, trim_partial_row
+# import the raw sample log
+from SampleLog import SampleLog
+# import the crash journal of the monitor phase
+from MonitorJournal import MonitorJournal, journal_path
+import numpy as np
 
 # import calls required for GUI creation
 from tkinter import *
@@ -18,7 +33,6 @@ import time
 
 # import calls for the directory finder
 import os
-from statistics import mean
 
 class MinMaxError(Exception):
     pass
@@ -107,14 +121,30 @@ class RazorbillProgrammer (object):
         # create instance of the PPMS instrument
         self.D3 = QDInstrument()
 
+        # sample the PPMS in the background (Hz); readings older than qd_stale_after (s) are not trusted
+        self.qd_poll_rate = 2.0
+        self.qd_stale_after = 10.0
+        self.D3_poller = QDPoller(rate=self.qd_poll_rate)
+        self.D3_poller.start()
+
         # create instance of the cap bridge
         self.rm = pyvisa.ResourceManager()
-        self.ANDY = self.rm.open_resource('GPIB0::28::INSTR') #AH capicitance bridge
-        self.SPARKY = self.rm.open_resource('ASRL10::INSTR') #Razorbill power supply RP100
+        self.ANDY = AHBridge(self.rm.open_resource('GPIB0::28::INSTR')) #AH capicitance bridge
+        # read the bridge continuously in the background; the GUI and writer take samples from its buffer
+        self.ANDY_acq = BridgeAcquisition(self.ANDY)
+        self.ANDY_acq.start()
+        self.SPARKY = RP100(self.rm.open_resource('ASRL10::INSTR')) #Razorbill power supply RP100
+        # timestamped supply readbacks, taken each time the monitor refreshes
+        self.SPARKY_samples = RingBuffer(('t', 'timestamp', 'ch1', 'ch2'), 100000)
 
         # voltage tables
         self.v_table = []
         self.v_table_i = 0
+        # a setpoint counts as reached once the readback is within v_tolerance (V), waiting at most v_settle_timeout (s)
+        self.v_tolerance = 0.1
+        self.v_settle_timeout = 30
+        # the voltage ramp in progress, see monitor_set_voltage
+        self.v_ramp = None
 
         # puppers
         self.pup1 = PhotoImage(file=r"pupper1_smol.png")
@@ -124,15 +154,42 @@ class RazorbillProgrammer (object):
 
         # file stream saves
         self.maii_save_stream = ""
+        # the output stays open for the whole run; rows are flushed every out_flush_rows rows or
+        # out_flush_interval (s), and synced to disk every out_fsync_interval (s)
+        self.maii_out = None
+        self.out_flush_rows = 10
+        self.out_flush_interval = 5.0
+        self.out_fsync_interval = 60.0
+        # the columnar HDF5 copy of the output (needs h5py), written next to the csv when HDF5 is On in the setup
+        self.maii_h5 = None
+        # every raw instrument sample also goes to a binary log next to the csv (name, buffer, [(channel, value, flags)])
+        self.raw_log = True
+        self.sample_log = None
+        self.log_cursors = {}
+        self.log_sources = [
+            ("bridge", self.ANDY_acq.buffer, [("capacitance", "capacitance", "flags"),
+                                              ("loss", "loss", "flags"),
+                                              ("bridge voltage", "voltage", "flags")]),
+            ("supply", self.SPARKY_samples, [("ch1", "ch1", None), ("ch2", "ch2", None)]),
+            ("qd", self.D3_poller.buffer, [("temperature", "temp", "temp_status_code"),
+                                           ("field", "field", "field_status_code")])]
         self.qd_open_file = ""
-        self.c_table = []
-        self.v1_table = []
-        self.v2_table = []
-        self.ti = 0.         
-        self.tcounter = 1.   
+        self.qd_header = None
+        self.qd_tail = None
+        self.merger = None
+        self.merge_sources = {"bridge": (self.ANDY_acq.buffer, ["capacitance"]),
+                              "supply": (self.SPARKY_samples, ["ch1", "ch2"], "asof")}
         self.need_header = True
         self.found_data = False
         self.timeline = 0
+        # column of the MultiVu time stamp in the output file
+        self.out_timeline = 0
+
+        # crash journal of the monitor phase; a journal left behind by a crashed run is offered at startup.
+        # main.py and main_field.py keep separate journals, since their setups do not fit each other
+        self.journal_file = journal_path(os.path.splitext(os.path.basename(__file__))[0])
+        self.journal = None
+        self.resumeOffered = False
 
     def navigate_browse(self, param):
         """ This function allows us to use the OS to browse for a file """
@@ -172,6 +229,11 @@ class RazorbillProgrammer (object):
                 # set control parameters to move onto next phase
                 self.inDirectoryGet = False
                 self.inMonitor = True
+                try:
+                    self.journal = MonitorJournal(self.journal_file)
+                    self.monitor_journal("start", full=True)
+                except OSError as e:
+                    print("could not open the journal ({e})... this run cannot be resumed after a crash".format(e=e))
                 self.run()
             # if the user backs out
             else:
@@ -300,7 +362,7 @@ class RazorbillProgrammer (object):
                 # do nothing
                 pass
 
-    def monitor_determine_state(self):
+    def monitor_determine_state(self, snap):
         """
         This definition determines and sets the state function so that we know what the PPMS is doing
         and what states we should set for the Razorbill... there are effectively 5 states that we have
@@ -341,7 +403,7 @@ class RazorbillProgrammer (object):
                                                                    "Voltages should be 0. Will now begin field\n"
                                                                    "equilibration to F_min and Temp choice."})
                 #check if ready to ramp field after zero field cooling
-                elif self.D3.field_status == "Holding (Driven)" and ((0+ftol) >= self.D3.field >= (0-ftol)) and self.D3.temp_status == "Stable" and ((temp-2) <= self.D3.temp <= (temp+2)):
+                elif snap.field_status == "Holding (Driven)" and ((0+ftol) >= snap.field >= (0-ftol)) and snap.temp_status == "Stable" and ((temp-2) <= snap.temp <= (temp+2)):
                     print(f'waiting {self.wait_t/60} min')
                     self.monDict["measureStatus"].update({"value": "Ma'ii is waiting for field stabilization. \n"
                                                                    f'time to wait: {self.wait_t/60}'
@@ -352,25 +414,25 @@ class RazorbillProgrammer (object):
                                                                    "We are ready to begin another strain increment\n"
                                                                    "and begin a new field ramp profile."})
                 # if we have a stable field and we're within tolerance to F_min, we're in the Ready state.
-                elif self.D3.field_status == "Holding (Driven)" and ((fmin+ftol) >= self.D3.field >= (fmin-ftol)):
+                elif snap.field_status == "Holding (Driven)" and ((fmin+ftol) >= snap.field >= (fmin-ftol)):
                     self.monitorState = "Ready"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the READY state. \n"
                                                                    "We are ready to begin another strain increment\n"
                                                                    "and begin a new field ramp profile."})
                     
                 # if we have a stable field and we're within tolerance to f_max, we're in the Finished state.
-                elif self.D3.field_status == "Holding (Driven)" and ((fmax+ftol) >= self.D3.field >= (fmax-ftol)):
+                elif snap.field_status == "Holding (Driven)" and ((fmax+ftol) >= snap.field >= (fmax-ftol)):
                     self.monitorState = "Finished"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the FINISHED state. \n"
                                                                    "A strain measurement has completed and we are \n"
                                                                    "ready to begin ramping back to fmin Oe."})
                     
                 # if we have a changing field we wait for stabilization
-                elif self.D3.field_status == "Holding (Driven)" and self.D3.temp_status in ["Tracking", "Chasing"]:
+                elif snap.field_status == "Holding (Driven)" and snap.temp_status in ["Tracking", "Chasing"]:
                     self.monitorState = "Busy"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the BUSY state. \n "
                                                                    "We are ramping to base temp\n"})
-                elif self.D3.field_status in ["Ramping", "Iterating"] and self.D3.temp_status in ["Stable", "Tracking", "Chasing"]:
+                elif snap.field_status in ["Ramping", "Iterating"] and snap.temp_status in ["Stable", "Tracking", "Chasing"]:
                     self.monitorState = "Busy"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the BUSY state. \n "
                                                                    "We are ramping to base field, or a strain measurement\n"
@@ -391,7 +453,7 @@ class RazorbillProgrammer (object):
                                                                    "equilibration to F_min and Temp choice."})
 
                 # if we have a stable field and we're within tolerance to f_min1, we're in the Ready1 state.
-                elif self.D3.field_status in ["Stable", "Holding (Driven)"] and ((fmin + ftol) >= self.D3.field >= (fmin - ftol)):
+                elif snap.field_status in ["Stable", "Holding (Driven)"] and ((fmin + ftol) >= snap.field >= (fmin - ftol)):
 
                     print(f'waiting {self.wait_t1/60} min')
                     self.monDict["measureStatus"].update({"value": "Ma'ii is waiting for thermalization. \n"
@@ -403,7 +465,7 @@ class RazorbillProgrammer (object):
                                                                    "We are ready to begin another strain increment\n"
                                                                    "and begin a new field ramp profile."})
                 # if we have a stable field and we're within tolerance to f_min1, we're in the Ready1 state.
-                elif self.D3.field_status in ["Stable", "Holding (Driven)"] and ((fmin2 + ftol) >= self.D3.field >= (fmin2 - ftol)):
+                elif snap.field_status in ["Stable", "Holding (Driven)"] and ((fmin2 + ftol) >= snap.field >= (fmin2 - ftol)):
 
                     print(f'waiting {self.wait_t2/60} min')
                     self.monDict["measureStatus"].update({"value": "Ma'ii is waiting for thermalization. \n"
@@ -415,93 +477,114 @@ class RazorbillProgrammer (object):
                                                                    "We are ready to begin another strain increment\n"
                                                                    "and begin a new field ramp profile."})
                 # if we have a stable field and we're within tolerance to f_max, we're in the Finished state.
-                elif self.D3.field_status in ["Stable", "Holding (Driven)"] and ((fmax + ftol) >= self.D3.field >= (fmax - ftol)):
+                elif snap.field_status in ["Stable", "Holding (Driven)"] and ((fmax + ftol) >= snap.field >= (fmax - ftol)):
                     self.monitorState = "Finished1"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the FINISHED1 state. \n"
                                                                    "A strain measurement has completed and we are \n"
                                                                    "ready to begin ramping back to base field."})
                 # if we have a stable field and we're within tolerance to f_max, we're in the Finished state.
-                elif self.D3.field_status in ["Stable", "Holding (Driven)"] and ((fmax2 + ftol) >= self.D3.field >= (fmax2 - ftol)):
+                elif snap.field_status in ["Stable", "Holding (Driven)"] and ((fmax2 + ftol) >= snap.field >= (fmax2 - ftol)):
                     self.monitorState = "Finished2"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the FINISHED2 state. \n"
                                                                    "A strain measurement has completed and we are \n"
                                                                    "ready to begin ramping back to base field."})
                 # if we have a stable field and we're within tolerance to f_max, we're in the Finished state.
-                elif self.D3.field_status in ["Stable", "Holding (Driven)","Ramping", "Iterating"]:
+                elif snap.field_status in ["Stable", "Holding (Driven)","Ramping", "Iterating"]:
                     self.monitorState = "Busy"
                     self.monDict["measureStatus"].update({"value": "Ma'ii is in the BUSY state. \n "
                                                                    "We are cooling to base, or a strain measurement\n"
                                                                    "is running as we ramp the max field."})
                 else:
-                    print(self.D3.field_status)
+                    print(snap.field_status)
                     raise StateException
 
             except StateException:
                 print("Something has gone very wrong and we've gone into an undefined state")
         print("Exited in", self.monitorState)
 
-    def monitor_set_voltage(self):
+    def monitor_set_voltage(self, then=None):
         """
         This definition controls the setting of voltages to the razorbill. At this point, the Vmax range and Vmin
         range for both piezo stacks is divided up based on the number of steps. Then we iterate the first stack
         through it's allowble values before invoking the second stack as well.
+
+        The ramp only gets started here; monitor_ramp_pending follows it on every monitor tick and calls then()
+        once both channels have settled, so the GUI keeps running during a long ramp.
         """
 
         try:
             print("voltage index {index}".format(index=self.v_table_i))
 
             print("Aiming to use the voltage setpoint {value}".format(value=self.v_table[self.v_table_i]))
-            time.sleep(1)
-
-            print('Activating Ch1')
-            time.sleep(1)
-            self.SPARKY.write('outp1 1')
-            print('Setting Ch1 Voltage to {value}'.format(value=self.v_table[self.v_table_i][0]))
-            time.sleep(1)
-            self.SPARKY.write('sour1:volt {value}'.format(value=self.v_table[self.v_table_i][0]))
-
-            print('Activating Ch2')
-            time.sleep(1)
-            self.SPARKY.write('outp2 1')
-            print('Setting Ch2 Voltage to {value}'.format(value=self.v_table[self.v_table_i][1]))
-            time.sleep(1)
-            self.SPARKY.write('sour2:volt {value}'.format(value=self.v_table[self.v_table_i][1]))
-
-            self.v_table_i = self.v_table_i + 1
-
+            v1, v2 = self.v_table[self.v_table_i]
         except IndexError:
             print("we're probably done")
             self.programEnd = True
+            if then is not None:
+                then()
+            return
+
+        # ramp both channels together at V_rate
+        rate = float(self.guiDict.get("V_rate").get("value"))
+        print('Ramping Ch1 Voltage to {v1} and Ch2 Voltage to {v2} at {rate} V/s'.format(v1=v1, v2=v2, rate=rate))
+        start = time.monotonic()
+        failed = False
+        try:
+            duration = self.SPARKY.ramp((v1, v2), rate)
+        except RP100Exception as e:
+            print(e)
+            duration = 0
+            failed = True
+        self.v_ramp = {"start": start, "deadline": start + duration + self.v_settle_timeout,
+                       "failed": failed, "then": then}
+        self.monitor_ramp_pending()
+
+    def monitor_ramp_pending(self):
+        """
+        Checks on the voltage ramp started by monitor_set_voltage without blocking. Returns True while it is
+        still running; once it has settled (or timed out) the strain index moves on and the waiting action runs.
+        """
 
-    def monitor_sparky_grounded(self):
-        print('set ch1 volt to 0')
-        time.sleep(0.1)
-        self.SPARKY.write('sour1:volt 0')
-
-        print('turn off chn 1')
-        time.sleep(0.1)
-        self.SPARKY.write('outp1 0')
-
-        print('set ch2 volt to 0')
-        time.sleep(0.1)
-        self.SPARKY.write('sour2:volt 0')
+        if self.v_ramp is None:
+            return False
+        done = False
+        if not self.v_ramp["failed"]:
+            try:
+                done = self.SPARKY.ramp_complete(tolerance=self.v_tolerance)
+            except RP100Exception as e:
+                print(e)
+            if not done and time.monotonic() < self.v_ramp["deadline"]:
+                return True
+
+        if done:
+            print('Both channels settled in {settle:.2f} s'.format(settle=time.monotonic() - self.v_ramp["start"]))
+        else:
+            print("RP100 did not reach {value} V".format(value=self.v_table[self.v_table_i]))
+            # make sure later writes are based on what the supply really has
+            self.SPARKY.stop_ramp()
+            self.SPARKY.resync()
+        then = self.v_ramp["then"]
+        self.v_ramp = None
+        self.v_table_i = self.v_table_i + 1
+        self.monitor_journal("voltage step")
+        if then is not None:
+            then()
+        return False
 
-        print('turn off chn 2')
-        time.sleep(0.1)
-        self.SPARKY.write('outp2 0')
+    def monitor_sparky_grounded(self):
+        print('set both channels to 0 V and turn them off')
+        self.SPARKY.ground()
 
         print('query both channels check that it did turn off')
-        time.sleep(0.1)
-        print(self.SPARKY.query('outp1?'))
-        print(self.SPARKY.query('outp2?'))
-
-        print('determine voltages')
-        time.sleep(0.1)
-        print(self.SPARKY.query('sour1:volt?'))
-        print(self.SPARKY.query('sour2:volt?'))
+        status = self.SPARKY.status()
+        for ch in (status.ch1, status.ch2):
+            print('ch{n}: output {state}, setpoint {volt} V'.format(n=ch.channel, state=ch.status, volt=ch.setpoint))
 
-    def monitor_control(self):
-        """ This definition controls the PPMS, AH bridge, and power supply """
+    def monitor_control(self, snap):
+        """
+        This definition controls the PPMS, AH bridge, and power supply. snap is the PPMS reading of this
+        monitor tick, see monitor_snapshot
+        """
 
         fmax = self.guiDict.get("F_max").get("value")
         fmin = self.guiDict.get("F_min").get("value")
@@ -514,9 +597,13 @@ class RazorbillProgrammer (object):
 
         #print("d3 field state"+self.D3.field_status)
 
+        # a strain step is still ramping; the field sweep waits for it
+        if self.monitor_ramp_pending():
+            return
+
         if mode == "Ramp":
             # make sure we determine the state of the program
-            self.monitor_determine_state()
+            self.monitor_determine_state(snap)
             print(self.monitorState)
 
             # if we have a Initial situation
@@ -553,13 +640,8 @@ class RazorbillProgrammer (object):
             elif self.monitorState == "Ready":
                 print("we are stable at base and ready to set field ramp and strains")
                 
-                # set voltages eventually
-                self.monitor_set_voltage()
-                time.sleep(5)
-                # set field using F_max and F_rate
-                print('MultiVu command... go to {fmax}Oe at {rate}Oe/min'.format(fmax=fmax, rate=frate))
-                self.D3.set.field(fmax, frate, 0, 1)
-                self.isMeasuring = True
+                # set voltages, then set field using F_max and F_rate once they have settled
+                self.monitor_set_voltage(then=lambda: self.monitor_start_sweep(fmax, frate))
 
             # check if we're in the finished state
             elif self.monitorState == "Finished":
@@ -583,7 +665,7 @@ class RazorbillProgrammer (object):
 
         elif mode == "Multi":
             # make sure we determine the state of the program
-            self.monitor_determine_state()
+            self.monitor_determine_state(snap)
             print(self.monitorState)
 
             # if we have a Initial situation in T1 with R1
@@ -625,13 +707,8 @@ class RazorbillProgrammer (object):
                     time.sleep(1)
                 print("field state reached")
 
-                # set voltages eventually
-                self.monitor_set_voltage()
-
-                # set field using F_max and F_rate
-                print('MultiVu command... go to {field}Oe at {rate}Oe/min'.format(field=fmax, rate=frate))
-                self.D3.set.field(fmax, frate, 0, 1)
-                self.isMeasuring = True
+                # set voltages, then set field using F_max and F_rate once they have settled
+                self.monitor_set_voltage(then=lambda: self.monitor_start_sweep(fmax, frate))
 
 
                 # check if we're in the ready state for REGIME 2
@@ -695,61 +772,63 @@ class RazorbillProgrammer (object):
                 #self.D3.set.temp(tmin, self.rampMax, 0)
                 self.isMeasuring = False
 
-    def monitor_update_vals(self):
-        """ This definition takes values from the peripherials and modifies the dictionaries accordingly """
+    def monitor_start_sweep(self, fmax, frate):
+        """ Starts the measurement: sweep the field to F_max at F_rate """
+
+        print('MultiVu command... go to {field}Oe at {rate}Oe/min'.format(field=fmax, rate=frate))
+        self.D3.set.field(fmax, frate, 0, 1)
+        self.isMeasuring = True
+
+    def monitor_snapshot(self):
+        """
+        Takes the one PPMS reading that the state machine and the display both use in this monitor tick.
+        The poller thread keeps the latest reading; only ask MultiVu directly if that has gone stale.
+        """
 
         try:
-            self.D3 = QDInstrument()
-            #print("take temperature")
-            #print(self.D3.temp)
-            self.monDict["Temperature"].update({"status": self.D3.temp_status})
-            self.monDict["Temperature"].update({"value": float(self.D3.temp)})
-            #print("take field")
-            self.monDict["Field"].update({"status": self.D3.field_status})
-            self.monDict["Field"].update({"value": float(self.D3.field)})
+            snap = self.D3_poller.latest(max_age=self.qd_stale_after)
+            if snap is None:
+                snap = self.D3.snapshot()
+            return snap
         except:
             self.multiVuCrash = True
             print("Coms with D3 appear to have failed... try restarting multiVu to recover")
             while self.multiVuCrash:
                 try:
-                    self.D3 = QDInstrument()
-                    # print("take temperature")
-                    # print(self.D3.temp)
-                    self.monDict["Temperature"].update({"status": self.D3.temp_status})
-                    self.monDict["Temperature"].update({"value": float(self.D3.temp)})
-                    # print("take field")
-                    self.monDict["Field"].update({"status": self.D3.field_status})
-                    self.monDict["Field"].update({"value": float(self.D3.field)})
+                    # only rebuild the MultiVu session once a call has actually failed
+                    self.D3.reconnect()
+                    snap = self.D3.snapshot()
                     self.multiVuCrash = False
                 except:
                     print("still down... waiting 10s")
                     time.sleep(10)
+            return snap
 
-        #print('take cap')
-        try:
-            cap_string = self.ANDY.query('FETCH').split("=")[2].strip().split()[0]
-        except:
-            print("ANDY is a little bitch")
-            cap_string = 0.0000000
-
-        self.monDict["Capacitance"].update({"value": float(cap_string)})
-
-        volt1state = self.SPARKY.query('outp1?').strip()
-        volt1 = float(self.SPARKY.query('sour1:volt?'))
-        volt2state = self.SPARKY.query('outp2?').strip()
-        volt2 = float(self.SPARKY.query('sour2:volt?'))
-        if volt1state == "0":
-            volt1state = "Latent"
-        elif volt1state == "1":
-            volt1state = "Active"
-        if volt2state == "0":
-            volt2state = "Latent"
-        elif volt2state == "1":
-            volt2state = "Active"
-        self.monDict["CH1Voltage"].update({"status": volt1state})
-        self.monDict["CH1Voltage"].update({"value": volt1})
-        self.monDict["CH2Voltage"].update({"status": volt2state})
-        self.monDict["CH2Voltage"].update({"value": volt2})
+    def monitor_update_vals(self, snap):
+        """ This definition takes values from the peripherials and modifies the dictionaries accordingly """
+
+        self.monDict["Temperature"].update({"status": snap.temp_status})
+        self.monDict["Temperature"].update({"value": float(snap.temp)})
+        self.monDict["Field"].update({"status": snap.field_status})
+        self.monDict["Field"].update({"value": float(snap.field)})
+
+        # newest capacitance from the acquisition thread, NaN if the bridge has not answered
+        self.monDict["Capacitance"].update({"value": float(self.ANDY_acq.latest())})
+        if not self.ANDY_acq.is_alive():
+            self.monDict["Capacitance"].update({"status": "not reading"})
+        elif self.ANDY_acq.last_error is not None:
+            self.monDict["Capacitance"].update({"status": "read failed: {e}".format(e=self.ANDY_acq.last_error)})
+        else:
+            self.monDict["Capacitance"].update({"status": ""})
+
+        # one round trip for both channels
+        sparky = self.SPARKY.status()
+        self.monDict["CH1Voltage"].update({"status": sparky.ch1.status})
+        self.monDict["CH1Voltage"].update({"value": sparky.ch1.setpoint})
+        self.monDict["CH2Voltage"].update({"status": sparky.ch2.status})
+        self.monDict["CH2Voltage"].update({"value": sparky.ch2.setpoint})
+        self.SPARKY_samples.append((sparky.monotonic, sparky.timestamp,
+                                    RP100.readback(sparky.ch1), RP100.readback(sparky.ch2)))
 
     def monitor_create(self):
         """ This definition creates the Ma'ii Experimental Monitor """
@@ -775,12 +854,152 @@ class RazorbillProgrammer (object):
 
         print("sequence has ended... turning off power supply.")
 
+        self.D3_poller.stop()
+        self.ANDY_acq.stop()
+        if self.maii_out is not None:
+            self.maii_out.close()
+        if self.maii_h5 is not None:
+            self.maii_h5.close()
+        if self.sample_log is not None:
+            self.monitor_log_samples()
+            self.sample_log.stop()
+        # the run ended on its own; there is nothing to resume
+        if self.journal is not None:
+            self.journal.finish()
+
         self.monitor_sparky_grounded()
 
         if messagebox.showinfo("Program Finished", "Program has ended. Confirm exit."):
             # destroy the current window
             self.root.destroy()
 
+    def setup_values(self):
+        """ The values entered in the Ma'ii Experiment Setup page """
+
+        return {key: {"value": field["value"], "units": field.get("units", "")}
+                for key, field in self.guiDict.items() if field.get("value") not in ("", None)}
+
+    def run_metadata(self):
+        """ The setup of this run, stored with the columnar output """
+
+        setup = self.setup_values()
+        try:
+            sparky_id = self.SPARKY.identify()
+        except Exception:
+            sparky_id = "unknown"
+        return {"guiDict": setup,
+                "v_table": self.v_table,
+                "MultiVu": getattr(self.D3._instrument, "name", "unknown"),
+                "qd_open_file": self.qd_open_file,
+                "bridge": self.ANDY.resource.resource_name,
+                "power supply": sparky_id,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    def monitor_journal(self, event, full=False):
+        """
+        Saves what is needed to pick the run up again after a crash: the state, the strain index,
+        the header state and where the tail reader is in the MultiVu file. full also saves the files
+        and the setup, which only needs to be done once at the start.
+        """
+
+        if self.journal is None:
+            return
+        last_time = None if self.merger is None else self.merger.previous_time
+        state = {"monitorState": self.monitorState,
+                 "v_table_i": self.v_table_i,
+                 "isMeasuring": self.isMeasuring,
+                 "need_header": self.need_header,
+                 "found_data": self.found_data,
+                 "timeline": self.timeline,
+                 "out_timeline": self.out_timeline,
+                 "qd_position": None if self.qd_tail is None else self.qd_tail.Position,
+                 "qd_rows": 0 if self.qd_tail is None else self.qd_tail.RowsRead,
+                 "last_row_time": last_time if last_time is not None and math.isfinite(last_time) else None}
+        if full:
+            state.update({"qd_open_file": self.qd_open_file,
+                          "maii_save_stream": self.maii_save_stream,
+                          "v_table": self.v_table,
+                          "guiDict": self.setup_values(),
+                          "started": time.time()})
+        try:
+            self.journal.record(event, **state)
+        except OSError as e:
+            print("could not write the journal ({e})".format(e=e))
+
+    def monitor_resume(self, state):
+        """ Restores a run from its journal and goes straight to the monitor """
+
+        for key, field in state.get("guiDict", {}).items():
+            if key in self.guiDict:
+                self.guiDict[key].update({"value": field["value"]})
+        self.v_table = [list(v) for v in state["v_table"]]
+        self.v_table_i = state["v_table_i"]
+        self.monitorState = state["monitorState"]
+        self.isMeasuring = state["isMeasuring"]
+        self.qd_open_file = state["qd_open_file"]
+        self.maii_save_stream = state["maii_save_stream"]
+        self.need_header = state["need_header"]
+        self.found_data = state["found_data"]
+        self.timeline = state["timeline"]
+        self.out_timeline = state["out_timeline"]
+
+        # carry on reading the MultiVu file where the journal says we were; rows up to the last one
+        # in the output are skipped by the writer
+        self.qd_header = MultiVuHeader(self.qd_open_file)
+        self.qd_tail = MultiVuFileTail(self.qd_open_file, Header=self.qd_header)
+        self.qd_tail.Resume(state["qd_position"], state["qd_rows"])
+        start_time = state.get("last_row_time") or state.get("started")
+        # the output is appended to, so drop a row that was only half written when the program stopped
+        if trim_partial_row(self.maii_save_stream):
+            print("dropped a partial last row from {file}".format(file=self.maii_save_stream))
+        row = last_row(self.maii_save_stream) if not self.need_header else None
+        try:
+            start_time = float(row[self.out_timeline])
+        except (TypeError, ValueError, IndexError):
+            pass
+        self.merger = RowMerger(self.merge_sources, start_time=start_time)
+
+        print("resuming in state {state} at voltage index {index}".format(state=self.monitorState, index=self.v_table_i))
+        self.journal = MonitorJournal(self.journal_file, fresh=False)
+        self.monitor_journal("resume", full=True)
+        self.inIntro = False
+        self.inMonitor = True
+
+    def monitor_offer_resume(self):
+        """ If a previous run crashed during the monitor phase, offer to pick it up again """
+
+        state = MonitorJournal.load(self.journal_file)
+        if state is None or "v_table" not in state:
+            return
+        if messagebox.askyesno("Resume previous run?",
+                               "A previous run did not finish.\n\n"
+                               "State: {state}\n"
+                               "Voltage index: {index} of {total}\n"
+                               "Output: {out}\n\n"
+                               "Would you like to continue it?".format(state=state["monitorState"],
+                                                                      index=state["v_table_i"],
+                                                                      total=len(state["v_table"]),
+                                                                      out=state["maii_save_stream"])):
+            self.monitor_resume(state)
+
+    def monitor_log_samples(self):
+        """ Hands every instrument sample taken since the last call to the raw sample log """
+
+        for name, buffer, columns in self.log_sources:
+            rows, self.log_cursors[name] = buffer.since(self.log_cursors.get(name, 0))
+            if not len(rows):
+                continue
+            times = rows[:, buffer.column("timestamp")]
+            for channel, value, flags in columns:
+                self.sample_log.log(channel, times, rows[:, buffer.column(value)],
+                                    rows[:, buffer.column(flags)] if flags else 0)
+
+    def out_columns(self):
+        """ The columns of the Ma'ii output: ours first, then those of the multivu file """
+
+        return ["Capacitance (pF)", "Ch1 Voltage (V)", "Ch2 Voltage (V)", "is Measuring?",
+                "Capacitance Std Err (pF)", "Capacitance Count", "Voltage Count"] + self.qd_header.Columns
+
     def monitor_writer(self):
         """
         This definition takes some values that have been updated in the dictionaries, it controls the matching
@@ -788,107 +1007,90 @@ class RazorbillProgrammer (object):
         and multiview... it requires the knowledge of the IOstreams defined in the directory GUI.
         """
 
-        # grab the header data from the multivu file
-        if self.need_header:
-            with open(self.qd_open_file, 'r') as qdFile, open(self.maii_save_stream, 'a+', newline="") as miFile:
-                for line in qdFile:
-                    if line.strip() != "[Data]" and not self.found_data:
-                        miFile.writelines(line)
-                    elif line.strip() == "[Data]" and not self.found_data:
-                        self.need_header = False
-                        self.found_data = True
-                        miFile.writelines(line)
-                    elif line.strip() != "[Data]" and self.found_data:
-                        myline = line.split(',')
-                        print(myline)
-
-                        cur_col = 0
-                        for header in myline:
-                            if "Time" in header:
-                                print("The time variable is in the {col} column".format(col=cur_col))
-                                self.timeline = cur_col
-                                break
-                            cur_col = cur_col + 1
-
-                        myline.insert(0, "is Measuring?")
-                        myline.insert(0, "Ch2 Voltage (V)")
-                        myline.insert(0, "Ch1 Voltage (V)")
-                        myline.insert(0, "Capacitance (pF)")
-
-                        writer = csv.writer(miFile)
-                        writer.writerow(myline)
-
-                        #mystring = ""
-                        #for item in myline:
-                        #    mystring = mystring + item + ','
-
-                        #miFile.writerow(myline)
-                        #print(mystring)
-                        break
-
-        with open(self.qd_open_file, 'r') as qdFile:
-            last_line = qdFile.readlines()[-1]
-            #print("reading a line from {dir}".format(dir=self.qd_open_file))
-            #print(last_line)
-            last_table = last_line.split(",")
-            #print("print first element from the dir .... time...? {ts}".format(ts=last_table[self.timeline]))
-            tf = last_table[self.timeline]
-
-        #print("ti is {ti}".format(ti=self.ti))
-        #print("tf is {tf}".format(tf=tf))
-        #print(self.ti == tf)
-        #print(self.c_table)
-
-        # initialize ti based on the first and only the first run
-        if self.ti != tf and self.tcounter == 1:
-            self.ti = tf
-            self.tcounter = 0
-
-        # actual logic for determining when to average the c, V1, v2 for each timestamp from MultiVu
-        if self.ti == tf:
+        if self.maii_out is None:
+            self.maii_out = CsvSink(self.maii_save_stream, flush_rows=self.out_flush_rows,
+                                    flush_interval=self.out_flush_interval,
+                                    fsync_interval=self.out_fsync_interval)
+        if self.raw_log and self.sample_log is None:
+            channels = [channel for _, _, columns in self.log_sources for channel, _, _ in columns]
+            self.sample_log = SampleLog(os.path.splitext(self.maii_save_stream)[0] + ".samples", channels)
+            self.sample_log.start()
+        if self.sample_log is not None:
+            self.monitor_log_samples()
+
+        # parse the multivu header once; the tail reader and the row decoding below share it
+        if self.qd_header is None:
             try:
-                c_i = float(self.monDict.get("Capacitance").get("value"))
-                v1_i = float(self.monDict.get("CH1Voltage").get("value"))
-                v2_i = float(self.monDict.get("CH2Voltage").get("value"))
-                self.c_table.append(c_i)
-                self.v1_table.append(v1_i)
-                self.v2_table.append(v2_i)
-            except TypeError:
-                print("your c, v1, or v2 is fucked and not a number... invalidating tables")
-                self.c_table = [0]
-                self.v1_i = [0]
-                self.v2_i = [0]
-        # but if the timestamp has changed... we need to write the data to a file and reupdate things
-        elif self.ti != tf and self.tcounter != 1:
-            cbar = mean(self.c_table)
-            v1bar = mean(self.v1_table)
-            v2bar = mean(self.v2_table)
-            last_table.insert(0, str(self.isMeasuring))
-            last_table.insert(0, v2bar)
-            last_table.insert(0, v1bar)
-            last_table.insert(0, cbar)
-            self.c_table = []
-            self.v1_table = []
-            self.v2_table = []
+                self.qd_header = MultiVuHeader(self.qd_open_file)
+            except (MultiVuFileException, FileNotFoundError) as e:
+                print(e)
+                return
+            self.timeline = self.qd_header.TimeCol if self.qd_header.TimeCol is not None else 0
+            print("The time variable is in the {col} column".format(col=self.timeline))
+
+        # copy the header of the multivu file to the output, with our columns in front of its own
+        if self.need_header:
+            for line in self.qd_header.HeaderLines[:-1]:
+                self.maii_out.write(line)
+            self.found_data = True
+
+            myline = self.out_columns()
+            self.out_timeline = len(myline) - len(self.qd_header.Columns) + self.timeline
+            print(myline)
+
+            self.maii_out.writerow(myline)
+            self.need_header = False
+            # the header is what makes the file readable; make sure it is on disk
+            self.maii_out.checkpoint()
+            self.monitor_journal("header")
+
+        # the optional HDF5 copy; a resumed run opens its existing file again and appends to it
+        if self.maii_h5 is None and self.guiDict["outHDF5"]["value"] == "On":
             try:
-                c_i = float(self.monDict.get("Capacitance").get("value"))
-                v1_i = float(self.monDict.get("CH1Voltage").get("value"))
-                v2_i = float(self.monDict.get("CH2Voltage").get("value"))
-                self.c_table.append(c_i)
-                self.v1_table.append(v1_i)
-                self.v2_table.append(v2_i)
-            except TypeError:
-                print("your c, v1, or v2 is fucked and not a number... invalidating tables")
-                self.c_table = [0]
-                self.v1_i = [0]
-                self.v2_i = [0]
-            self.ti = tf
-
-            with open(self.maii_save_stream, 'a+', newline="") as miFile:
-                writer = csv.writer(miFile)
-                writer.writerow(last_table)
-                print('writing to file')
-                print(last_table)
+                self.maii_h5 = Hdf5Sink(os.path.splitext(self.maii_save_stream)[0] + ".h5",
+                                        self.out_columns(), metadata=self.run_metadata(),
+                                        flush_rows=self.out_flush_rows,
+                                        flush_interval=self.out_flush_interval)
+            except (MaiiOutputException, OSError) as e:
+                print("no HDF5 output for this run ({e})".format(e=e))
+                self.guiDict["outHDF5"].update({"value": "Off"})
+
+        # only the rows MultiVu appended since the last call; the tail reader remembers where it stopped
+        if self.qd_tail is None:
+            self.qd_tail = MultiVuFileTail(self.qd_open_file, StartAtEnd=True, Header=self.qd_header)
+        if self.merger is None:
+            # samples taken before the first new row cannot be told apart from the rows already in the file
+            self.merger = RowMerger(self.merge_sources, start_time=time.time())
+        new_rows = self.qd_tail.ReadNewRows()
+        if not new_rows:
+            self.maii_out.poll()
+            if self.maii_h5 is not None:
+                self.maii_h5.poll()
+            return
+
+        # each row gets the samples taken between the previous row's time stamp and its own
+        time_col = self.qd_header.Columns[self.timeline]
+        row_times = self.qd_header.DecodeRows(new_rows, [time_col])[time_col]
+        # after a resume the tail may go over rows that were already written
+        kept = [i for i, t in enumerate(row_times) if not t <= self.merger.previous_time]
+        if len(kept) < len(new_rows):
+            new_rows = [new_rows[i] for i in kept]
+            row_times = row_times[kept]
+            if not new_rows:
+                return
+        stats = self.merger.merge(row_times)
+
+        # the supply is only read once per monitor tick, so each row takes its newest reading instead
+        # of an average, so there is no voltage error column and the count only says whether there was one
+        for row, c, v in zip(new_rows, stats["bridge"], stats["supply"]):
+            c_mean, c_err = c.mean, c.stderr
+            row = [c_mean[0], v[0], v[1], str(self.isMeasuring),
+                   c_err[0], c.count[0], int(not np.isnan(v).all())] + row
+            self.maii_out.writerow(row)
+            if self.maii_h5 is not None:
+                self.maii_h5.writerow(row)
+            print('writing to file')
+            print(row)
 
     def monitor_update_screen(self):
         """ This definition controls screen updates when within the "monitor" side of Ma'ii """
@@ -898,8 +1100,13 @@ class RazorbillProgrammer (object):
             print("Refresh screen to eliminate some weird glitches?")
             self.monitor_create()
 
-        self.monitor_control()
-        self.monitor_update_vals()
+        # one PPMS reading for both the state machine and the display
+        snap = self.monitor_snapshot()
+        state = self.monitorState
+        self.monitor_control(snap)
+        if self.monitorState != state:
+            self.monitor_journal("state")
+        self.monitor_update_vals(snap)
         self.monitor_writer()
 
         # the whole thing is effectively a loop... but each column/row may have different display parameters
@@ -1541,6 +1748,9 @@ class RazorbillProgrammer (object):
         return True
 
     def run(self):
+        if self.inIntro and not self.resumeOffered:
+            self.resumeOffered = True
+            self.monitor_offer_resume()
         if self.inIntro:
             self.intro_create()
         elif self.inExpSetup:
@@ -7,6 +7,9 @@ import numpy as np
 
 from dataclasses import dataclass
 from QDInst import QDInstrument
+from RazorbillRP100 import RP100
+from AHBridge import AHBridge, BridgeAcquisition
+from MultiVuDataFile import iter_rows
 from pyvisa import ResourceManager
 
 
@@ -16,6 +19,7 @@ TEMPS = [30, 10, 5, 2] # Just one temp, 30K
 VAS   = np.array([130, 150, 175]) # Voltages on CH1 Tension
 VBS   = np.zeros_like(VAS)     # Zeros on CH2 Compression
 FIELD = (-90_000, 90_000, 50)  # -90k Oe to 90k Oe at 10 Oe/sec?
+V_RATE = 5                     # Piezo ramp rate in V/s
 
 QD_FILES = r"C:/Users/sysadmin/Desktop/Razorbill-WilsonGroup/Sarah/"
 QD_FILE = max(glob.glob(QD_FILES+"*.dat"), key=os.path.getctime)
@@ -38,56 +42,70 @@ def withinpercent(a, b, p = 1):
     return False
 
 class Sparky:
-    def __init__(self, rm, label=sparky_port):
-        self.sparky = rm.open_resource(label)
+    def __init__(self, rm, label=sparky_port, rate=V_RATE):
+        self.sparky = RP100(rm.open_resource(label))
+        self.rate = rate
         # Store a reference to the resource manager so this gets dropped first
         self.__rm = rm
 
     @property
     def ch1(self):
-        return float(self.sparky.query("sour1:volt?"))
+        return self.sparky.status().ch1.setpoint
 
     @property
     def ch2(self):
-        return float(self.sparky.query("sour2:volt?"))
+        return self.sparky.status().ch2.setpoint
 
     @ch1.setter
     def ch1(self, voltage):
-        self.sparky.write("outp1 1")
-        self.sparky.write("sour1:volt {:f}".format(voltage))
+        self.sparky.output(1, True)
+        self.sparky.set_voltage(1, voltage)
 
     @ch2.setter
     def ch2(self, voltage):
-        self.sparky.write("outp2 1")
-        self.sparky.write("sour2:volt {:f}".format(voltage))
-    
+        self.sparky.output(2, True)
+        self.sparky.set_voltage(2, voltage)
+
+    def ramp(self, ch1, ch2):
+        """
+        Ramps both channels together at self.rate and waits until they have settled
+        """
+        duration = self.sparky.ramp((ch1, ch2), self.rate)
+        self.sparky.wait_ramp(timeout=duration + 30)
+
+    def ramp_complete(self):
+        return self.sparky.ramp_complete()
+
     def ch1_ramp(self, voltage):
-        for v in np.arange(self.ch1, voltage, 0.1):
-            self.ch1 = v
-        self.ch1 = voltage
-    
+        self.ramp(voltage, self.ch2)
+
     def ch2_ramp(self, voltage):
-        for v in np.arange(self.ch2, voltage, 0.1):
-            self.ch2 = v
-        self.ch2 = voltage
+        self.ramp(self.ch1, voltage)
 
     def __del__(self):
         """
         Grounds the outputs when the program ends
         """
-        self.sparky.write("sour1:volt 0")
-        self.sparky.write("outp1 0")
-        self.sparky.write("sour2:volt 0")
-        self.sparky.write("outp2 0")
+        self.sparky.ground()
 
 
 class Andy:
     def __init__(self, rm, label=andy_port):
-        self.andy = rm.open_resource(label)
+        self.andy = AHBridge(rm.open_resource(label))
+        # Read the bridge back-to-back in the background so no sample is missed
+        self.acquisition = BridgeAcquisition(self.andy)
+        self.acquisition.start()
         self.__rm = rm
 
     def capacitance_string(self):
-        return self.andy.query("FETCH")
+        return self.acquisition.latest_reply
+
+    def samples(self):
+        """
+        Every sample still held by the acquisition buffer, one row per reading with the
+        columns of BridgeAcquisition.COLUMNS: (t, timestamp, capacitance, loss, voltage, flags)
+        """
+        return self.acquisition.buffer.last(len(self.acquisition.buffer))
 
 
 class QDButNotAwful:
@@ -156,11 +174,18 @@ class Measurment:
     voltages: tuple[float, float]
     field: float
     capstring: str
-    qdline: tuple[str, int]
+    qdline: tuple[dict, int]
 
 
 measurments = []
 
+# Follows QD_FILE so each pass of the loop only takes the rows appended since the last one; a pass
+# waits at most 0.5 s for MultiVu to write something
+qd_rows = iter_rows(QD_FILE, poll=0.5, idle=True)
+qd_last_row = {}
+qd_rows_read = 0
+last_capstring = None
+
 #intitiate starting sequence
 sparky.ch1 = 0
 sparky.ch2 = 0
@@ -169,8 +194,7 @@ qd.wait_temp(TEMPS[0])
 
 #measure for each condition
 for va, vb in zip(VAS, VBS):
-    sparky.ch1_ramp(va)
-    sparky.ch2_ramp(vb)
+    sparky.ramp(va, vb)
     
     for temp in TEMPS:
         qd.zero_field()
@@ -179,20 +203,29 @@ for va, vb in zip(VAS, VBS):
         qd.ramp_field(*FIELD)
         
         while not qd.ramp_complete():
-            lines = open(QD_FILE, 'r').readlines()
+            new_rows = next(qd_rows)
+            if len(new_rows):
+                qd_last_row = new_rows.iloc[-1].to_dict()
+                qd_rows_read += len(new_rows)
+            # every reply is a new string, so this is only the same object if the bridge has not answered since
+            capstring = andy.capacitance_string()
+            if not len(new_rows) and capstring is last_capstring:
+                continue
+            last_capstring = capstring
             measurments.append(
                 Measurment(
                     temp,
                     (va, vb),
                     qd.get_field(),
-                    andy.capacitance_string(),
-                    (lines[-1], len(lines))
+                    capstring,
+                    (qd_last_row, qd_rows_read)
                 )
             )
             print(measurments[-1])
         
 #output data file
 pickle.dump((measurments, open(QD_FILE, "r").read()) , open("mymeasurements-{:f}.pkl".format(time.time()), "wb"))
+np.save("mycapacitance-{:f}.npy".format(time.time()), andy.samples())
 
 #outro sequence
 sparky.ch1 = 0
@@ -0,0 +1,36 @@
+"""
+Checks that ConvertToParquet writes every chunk of a file with the same
+column types, so that a partition reads back as one table.
+
+Run with
+    python -m pytest test_ConvertToParquet.py
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from ConvertToParquet import convert_file, partition_name
+
+
+def test_integer_then_fractional_chunks(tmp_path):
+    # the first chunk only has whole numbers, which pandas reads as int64
+    values = [float(i) for i in range(10)] + [10.5 + i for i in range(10)]
+    path = tmp_path / 'plain.csv'
+    path.write_text('Time,Value,Label\n' + ''.join(f'{i},{v:g},row{i}\n' for i, v in enumerate(values)))
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    entry = convert_file(str(path), str(out), chunksize=10)
+    assert entry['rows'] == 20
+    assert entry['parts'] == 2
+
+    table = pq.read_table(str(out / partition_name(str(path))))
+    assert table.schema.field('Time').type == pa.float64()
+    assert table.schema.field('Value').type == pa.float64()
+    np.testing.assert_array_equal(table.column('Value').to_numpy(), values)
+    assert table.column('Label').to_pylist() == [f'row{i}' for i in range(20)]
+
+    dataset = ds.dataset(str(out), partitioning='hive')
+    assert dataset.to_table().num_rows == 20
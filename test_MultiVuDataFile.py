@@ -0,0 +1,177 @@
+"""
+Checks that the pandas based parseMVuDataFile() reads MultiVu files the
+same way as the original line by line parser (fast=False), and pins
+down where the two are known to differ.  Also checks that the writer
+thread gets every row onto the disk.
+
+Run with
+    python -m pytest test_MultiVuDataFile.py
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from MultiVuDataFile import MultiVuDataFile, MultiVuFileException
+
+HEADER = (
+    '[Header]\n'
+    '; Copyright (c) 2003-2013, Quantum Design, Inc. All rights reserved.\n'
+    'FILEOPENTIME, 1620348924.000000, 05/06/2021, 8:55:24 PM\n'
+    'BYAPP, MultiVuDataFile Python class\n'
+    'TITLE, parser test\n'
+    '; a comment line in the header, with, commas\n'
+    'DATATYPE, COMMENT,1\n'
+    'DATATYPE, TIME,2\n'
+    'TIMEMODE, SECONDS, RELATIVE\n'
+    'STARTUPAXIS, X, 2, LINEAR, AUTO\n'
+    'STARTUPAXIS, Y1, 3, LOG, AUTO\n'
+    '[Data]\n'
+    '"Comment","Time Stamp (sec)","Temperature (K)","Cap"\n'
+)
+
+
+def write_file(tmp_path, rows):
+    path = tmp_path / 'test.dat'
+    path.write_text(HEADER + ''.join(row + '\n' for row in rows))
+    return str(path)
+
+
+def parse(path, **kwargs):
+    return MultiVuDataFile().parseMVuDataFile(path, **kwargs)
+
+
+def test_same_as_old_parser(tmp_path):
+    rows = [f'{"started" if i == 0 else ""},{1620348924.0125 + i:.4f},{300 - i * 0.5},{12.5 + i * 1e-4}'
+            for i in range(200)]
+    rows[57] = 'field set,1620348981.0125,271.5,12.5057'
+    path = write_file(tmp_path, rows)
+
+    fast = parse(path)
+    slow = parse(path, fast=False)
+
+    assert list(fast.columns) == list(slow.columns) == ['Comment', 'Time Stamp (sec)', 'Temperature (K)', 'Cap']
+    assert len(fast) == len(slow) == 200
+    for name in ['Time Stamp (sec)', 'Temperature (K)', 'Cap']:
+        assert fast[name].dtype == np.float64
+        np.testing.assert_array_equal(fast[name].to_numpy(), slow[name].astype(np.float64).to_numpy())
+    assert list(fast['Comment']) == list(slow['Comment'])
+    assert fast['Comment'][0] == 'started'
+    assert fast['Comment'][57] == 'field set'
+
+
+def test_blank_values(tmp_path):
+    path = write_file(tmp_path, ['a,1620348924.0,300.0,12.5',
+                                 ',1620348925.0,,12.6',
+                                 ',1620348926.0,299.0,'])
+
+    fast = parse(path)
+    slow = parse(path, fast=False)
+
+    # a blank number is NaN for the fast parser, the old one keeps the empty string
+    assert math.isnan(fast['Temperature (K)'][1])
+    assert math.isnan(fast['Cap'][2])
+    assert slow['Temperature (K)'][1] == ''
+    assert slow['Cap'][2] == ''
+    # a blank comment is an empty string for both
+    assert fast['Comment'][1] == slow['Comment'][1] == ''
+    assert fast['Temperature (K)'][2] == slow['Temperature (K)'][2] == 299.0
+
+
+def test_blank_lines(tmp_path):
+    path = write_file(tmp_path, ['a,1620348924.0,300.0,12.5',
+                                 '',
+                                 ',1620348925.0,299.5,12.6',
+                                 '',
+                                 ',1620348926.0,299.0,12.7'])
+
+    fast = parse(path)
+    np.testing.assert_array_equal(fast['Temperature (K)'].to_numpy(), [300.0, 299.5, 299.0])
+
+    # the old parser takes a blank line for a row with the wrong number of values
+    with pytest.raises(MultiVuFileException):
+        parse(path, fast=False)
+
+
+def test_quoted_fields(tmp_path):
+    path = write_file(tmp_path, ['"quoted",1620348924.0,300.0,12.5',
+                                 ',1620348925.0,299.5,12.6'])
+
+    fast = parse(path)
+    slow = parse(path, fast=False)
+
+    # the fast parser strips the quotes of a quoted field, the old one keeps them
+    assert fast['Comment'][0] == 'quoted'
+    assert slow['Comment'][0] == '"quoted"'
+    np.testing.assert_array_equal(fast['Cap'].to_numpy(), slow['Cap'].astype(np.float64).to_numpy())
+
+
+def test_quoted_comma(tmp_path):
+    path = write_file(tmp_path, ['"T = 300 K, H = 0 Oe",1620348924.0,300.0,12.5'])
+
+    fast = parse(path)
+    assert fast['Comment'][0] == 'T = 300 K, H = 0 Oe'
+    assert fast['Cap'][0] == 12.5
+
+    # the old parser splits on every comma, quoted or not
+    with pytest.raises(MultiVuFileException):
+        parse(path, fast=False)
+
+
+def test_usecols_and_chunks(tmp_path):
+    rows = [f',{1620348924.0 + i},{300 - i * 0.5},{12.5 + i * 1e-4}' for i in range(95)]
+    path = write_file(tmp_path, rows)
+
+    whole = parse(path)
+    chunks = list(parse(path, chunksize=10))
+    assert [len(chunk) for chunk in chunks] == [10] * 9 + [5]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole)
+
+    some = parse(path, usecols=['Cap', 'Time Stamp (sec)'])
+    assert list(some.columns) == ['Cap', 'Time Stamp (sec)']
+    pd.testing.assert_frame_equal(some, whole[['Cap', 'Time Stamp (sec)']])
+
+
+def test_writer_thread(tmp_path):
+    path = str(tmp_path / 'writer.dat')
+    data = MultiVuDataFile()
+    data.AddMultipleColumns(['Cap', 'Volt'])
+    data.CreateFileAndWriteHeader(path, 'writer test')
+    writer = data.StartWriter(MaxQueue=50, FlushRows=1000, FlushInterval=0.05)
+
+    # a row written directly while the writer runs reaches the disk within FlushInterval
+    data.SetValue('Cap', 1.0)
+    data.WriteData()
+    deadline = time.monotonic() + 5
+    while len(parse(path)) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(parse(path)) == 1
+
+    def submit():
+        for i in range(500):
+            data.SubmitRow({'Volt': float(i)})
+
+    def write():
+        for i in range(500):
+            data.SetValue('Cap', float(i))
+            data.WriteData()
+
+    threads = [threading.Thread(target=submit), threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    data.StopWriter()
+    assert writer.Closed
+
+    # writing goes straight to the file again once the writer has stopped
+    data.WriteRows([[2.0, 3.0]], Columns=['Cap', 'Volt'])
+
+    frame = parse(path)
+    assert len(frame) == 1002
+    assert writer.Written == writer.Submitted == 500
+    assert frame['Volt'].notna().sum() == 501
@@ -0,0 +1,74 @@
+"""
+Checks that MultiVuDataIndex finds the same rows as reading the whole
+file with parseMVuDataFile(), also when the data has blank lines.
+
+Run with
+    python -m pytest test_MultiVuDataIndex.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from MultiVuDataFile import MultiVuDataFile
+from MultiVuDataIndex import MultiVuDataIndex
+
+HEADER = (
+    '[Header]\n'
+    'TITLE, index test\n'
+    'DATATYPE, COMMENT,1\n'
+    'DATATYPE, TIME,2\n'
+    '[Data]\n'
+    '"Comment","Time Stamp (sec)","Temperature (K)"\n'
+)
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    lines = []
+    for i in range(1000):
+        lines.append(f',{1620348924.0 + i},{300 - i * 0.25}\n')
+        if i % 7 == 6:
+            lines.append('\n')
+    path = tmp_path / 'test.dat'
+    path.write_text(HEADER + ''.join(lines))
+    return str(path)
+
+
+@pytest.mark.parametrize('i0, i1', [(0, 5), (48, 53), (120, 130), (333, 334), (990, 1000), (0, 1000)])
+def test_read_rows(data_file, i0, i1):
+    whole = MultiVuDataFile().parseMVuDataFile(data_file)
+    index = MultiVuDataIndex(data_file, every=50)
+
+    rows = index.read_rows(i0, i1)
+    assert index.rows == 1000
+    pd.testing.assert_frame_equal(rows, whole.iloc[i0:i1])
+
+
+def test_read_range(data_file):
+    whole = MultiVuDataFile().parseMVuDataFile(data_file)
+    index = MultiVuDataIndex(data_file, every=50)
+
+    t0, t1 = 1620348924.0 + 117, 1620348924.0 + 411
+    rows = index.read_range(t0, t1, usecols=['Temperature (K)'])
+    np.testing.assert_array_equal(rows['Temperature (K)'].to_numpy(),
+                                  whole['Temperature (K)'].to_numpy()[117:412])
+
+
+def test_reopen_and_append(data_file):
+    MultiVuDataIndex(data_file, every=50)
+    with open(data_file, 'a') as f:
+        f.write('\n,1620349924.0,50.0\n')
+
+    index = MultiVuDataIndex(data_file, every=50)
+    assert index.rows == 1001
+    assert index.read_rows(1000, 1001)['Temperature (K)'].tolist() == [50.0]
+
+
+def test_unwritable_sidecar(data_file, tmp_path):
+    index_path = str(tmp_path / 'missing' / 'test.dat.idx.npz')
+
+    index = MultiVuDataIndex(data_file, every=50, index_path=index_path)
+    assert index.rows == 1000
+    assert index.read_rows(999, 1000)['Temperature (K)'].tolist() == [300 - 999 * 0.25]
+    assert not (tmp_path / 'missing').exists()
@@ -339,6 +339,15 @@ guiFields = {
         "bounds": [1.0, 0.1],
         "value": 0.1
     },
+    "outHDF5": {
+        "type": 'TE',
+        "label": '  HDF5:  ',
+        "units": '',
+        "stats": 'Holding Default Value',
+        "color": blk,
+        "bounds": ['Off', 'On'],
+        "value": 'Off'
+    },
     "blank4": {
         "type": 'B',
         "label": '',